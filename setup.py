@@ -8,6 +8,7 @@ with open("requirements.test.txt") as file_:
 
 extras = {
     "test": test_requirements,
+    "performance": ["uvloop"],
 }
 
 setup(
@@ -16,7 +17,8 @@ setup(
     discription="Simple Discord bot and utilities",
     packages=find_packages("src"),
     package_dir={"": "src"},
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     install_requires=requirements,
     test_require=test_requirements,
+    extras_require=extras,
 )
@@ -1,7 +1,15 @@
+import gc
 import os
 import logging
 
 
+# Generation thresholds used by the performance profile, the defaults (700, 10, 10) make the
+# collector run constantly with the amount of short lived objects the gateway events create.
+GC_THRESHOLDS = (50000, 20, 100)
+
+_gc_tuned = False
+
+
 def _setup_logging(logpath, print_debug=False):
     """Setup logging.
     Args:
@@ -44,6 +52,36 @@ def _fetch_bot_token():
     raise RuntimeError("no IkaBot discord token configured")
 
 
+def _install_uvloop():
+    """Install the uvloop event loop policy if uvloop is available.
+    Needs to be done before the bot gets created as that grabs the event loop.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        logging.info("uvloop is not installed, using the default event loop")
+        return
+
+    uvloop.install()
+    logging.info("using the uvloop event loop")
+
+
+def _tune_gc():
+    """Move everything alive right now out of reach of the garbage collector and raise the
+    collection thresholds. Meant to be invoked once the long lived startup state is loaded, later
+    invocations do nothing as on_ready fires again on every reconnect.
+    """
+    global _gc_tuned
+    if _gc_tuned:
+        return
+    _gc_tuned = True
+
+    gc.collect()
+    gc.freeze()
+    gc.set_threshold(*GC_THRESHOLDS)
+    logging.info("tuned gc, thresholds set to {0}".format(GC_THRESHOLDS))
+
+
 def _parse_args():
     import argparse
 
@@ -56,31 +94,64 @@ def _parse_args():
         "--log-dir",
         help="directory to log files into, takes priority over the environment setting.",
     )
+    parser.add_argument(
+        "--performance", action="store_true", default=False,
+        help="run with the performance profile; uvloop when available and tuned gc.",
+    )
+    parser.add_argument(
+        "--capture-joins",
+        help="file to capture all joins in for offline replay, see ikabot.capture.",
+    )
+    parser.add_argument(
+        "--message-filter", action="store_true", default=False,
+        help="enable the message filter cog.",
+    )
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = _parse_args()
-    _setup_logging(
-        args.log_dir or os.getenv("IKA_LOG_PATH"),
-        print_debug=args.debug,
-    )
+    log_path = args.log_dir or os.getenv("IKA_LOG_PATH")
+    _setup_logging(log_path, print_debug=args.debug)
+
+    if args.performance:
+        _install_uvloop()
 
-    from .base import bot
-    from .entrybanner import EntryBannerCog, EntryBannerDataStore
+    from .base import bot, set_log_dir
+    set_log_dir(log_path)
+    from .entrybanner import EntryBannerCog
+    from .guildconfig import GuildDataStore
 
     if not os.getenv("IKA_DATA_PATH"):
         raise RuntimeError("IKA_DATA_PATH has not been configured")
 
-    eb_data = EntryBannerDataStore(
+    eb_data = GuildDataStore(
         os.path.join(os.getenv("IKA_DATA_PATH"), "entrybanner.json")
     )
     eb_data.load()
 
+    mf_data = None
+    if args.message_filter:
+        mf_data = GuildDataStore(
+            os.path.join(os.getenv("IKA_DATA_PATH"), "messagefilter.json")
+        )
+        mf_data.load()
+
+    recorder = None
+    if args.capture_joins:
+        from .capture import JoinRecorder
+        recorder = JoinRecorder(args.capture_joins)
+
     @bot.event
     async def on_ready():
         logging.getLogger().info("IkaBot ready for use!")
-        bot.add_cog(EntryBannerCog(bot, eb_data))
+        bot.add_cog(EntryBannerCog(bot, eb_data, recorder=recorder))
+        if mf_data:
+            from .messagefilter import MessageFilterCog
+            bot.add_cog(MessageFilterCog(bot, mf_data))
+
+        if args.performance:
+            _tune_gc()
 
     bot.run(_fetch_bot_token())
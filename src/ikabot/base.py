@@ -1,11 +1,15 @@
 import asyncio
+import cProfile
+import io
 import logging
 import os
+import pstats
 import string
 import sys
 import traceback
+import tracemalloc
 
-from collections import OrderedDict
+from datetime import datetime
 
 import discord
 from discord.ext import commands
@@ -24,6 +28,37 @@ intents.members = True
 # Create the bot.
 bot = commands.Bot(intents=intents, command_prefix="$")
 
+# How long shutdown waits for the cogs to finish their in-flight work.
+SHUTDOWN_DRAIN_TIMEOUT = 10.0
+
+# Discord allows 20 distinct reactions on a message, the menus keep room for their controls.
+MENU_PAGE_SIZE = 16
+MENU_PREVIOUS = "\N{BLACK LEFT-POINTING TRIANGLE}"
+MENU_NEXT = "\N{BLACK RIGHT-POINTING TRIANGLE}"
+MENU_CONFIRM = "\N{WHITE HEAVY CHECK MARK}"
+MENU_TIMEOUT = 20.0
+
+# Directory the profiling commands write their results to, see set_log_dir.
+_log_dir = None
+# Maximum amount of frames tracemalloc can keep per allocation.
+TRACEMALLOC_MAX_FRAMES = 65535
+# Active cProfile.Profile, None if no profile is running.
+_profiler = None
+
+
+def set_log_dir(log_dir):
+    """Set the directory the profiling commands dump their results in.
+    Args:
+        log_dir (str): directory to write profiles to, None disables the profiling commands.
+    """
+    global _log_dir
+    _log_dir = log_dir
+
+
+def _dump_path(kind, extension):
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(_log_dir, "ikabot-{0}-{1}.{2}".format(kind, timestamp, extension))
+
 
 @bot.event
 async def on_command_error(ctx, error):
@@ -55,6 +90,12 @@ async def on_command_error(ctx, error):
 async def shutdown(ctx):
     logger.info("IkaBot shutting down..")
     await ctx.reply("shutting down..")
+
+    # Let the cogs stop accepting new events and finish what they are doing before logging out.
+    drains = [cog.drain(SHUTDOWN_DRAIN_TIMEOUT) for cog in ctx.bot.cogs.values() if hasattr(cog, "drain")]
+    if drains:
+        await asyncio.gather(*drains)
+
     await ctx.bot.logout()
     logger.info("IkaBot shut down")
 
@@ -71,6 +112,150 @@ async def pong(ctx):
     await ctx.reply("ping!")
 
 
+# Profiling tools.
+
+
+@bot.command("profile-start", ignore_extra=False)
+@commands.is_owner()
+async def profile_start(ctx):
+    """
+    Starts a CPU profile of everything running on the event loop until profile-stop is invoked.
+    """
+    global _profiler
+    if not _log_dir:
+        await ctx.reply("no log directory configured to write the profile to.", mention_author=False)
+        return
+    if _profiler is not None:
+        await ctx.reply("a profile is already running.", mention_author=False)
+        return
+
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    logger.info("started cpu profile, done by {0} ({1})".format(
+        "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+    ))
+    await ctx.reply("profiling started.", mention_author=False)
+
+
+@bot.command("profile-stop", ignore_extra=False)
+@commands.is_owner()
+async def profile_stop(ctx, amount: int=20):
+    """
+    Stops the running CPU profile and writes the raw stats and a summary of the top entries,
+    sorted by cumulative time, to the log directory.
+    """
+    global _profiler
+    if amount < 1:
+        await ctx.reply(
+            "{0} amount must be a positive number.".format(ctx.author.mention), mention_author=False
+        )
+        return
+    if _profiler is None:
+        await ctx.reply("no profile is running.", mention_author=False)
+        return
+
+    profiler, _profiler = _profiler, None
+    profiler.disable()
+
+    stats_path = _dump_path("profile", "prof")
+    profiler.dump_stats(stats_path)
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(amount)
+    summary_path = _dump_path("profile", "txt")
+    with open(summary_path, "w") as outfile:
+        outfile.write(summary.getvalue())
+
+    logger.info("wrote cpu profile to {0}".format(stats_path))
+    await ctx.reply("profile written to {0}".format(stats_path), mention_author=False)
+
+
+@bot.command("tracemalloc-start", ignore_extra=False)
+@commands.is_owner()
+async def tracemalloc_start(ctx, frames: int=1):
+    """
+    Starts tracing memory allocations, keeping the given amount of frames per allocation.
+    """
+    if frames < 1 or frames > TRACEMALLOC_MAX_FRAMES:
+        await ctx.reply(
+            "{0} frames must be between 1 and {1}.".format(ctx.author.mention, TRACEMALLOC_MAX_FRAMES),
+            mention_author=False
+        )
+        return
+    if not _log_dir:
+        await ctx.reply("no log directory configured to write the snapshot to.", mention_author=False)
+        return
+    if tracemalloc.is_tracing():
+        await ctx.reply("tracemalloc is already running.", mention_author=False)
+        return
+
+    tracemalloc.start(frames)
+    logger.info("started tracemalloc, done by {0} ({1})".format(
+        "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+    ))
+    await ctx.reply("tracemalloc started.", mention_author=False)
+
+
+@bot.command("tracemalloc-stop", ignore_extra=False)
+@commands.is_owner()
+async def tracemalloc_stop(ctx, amount: int=20):
+    """
+    Takes a snapshot of the traced allocations, writes it and a summary of the largest allocation
+    sites to the log directory and stops tracing.
+    """
+    if amount < 1:
+        await ctx.reply(
+            "{0} amount must be a positive number.".format(ctx.author.mention), mention_author=False
+        )
+        return
+    if not tracemalloc.is_tracing():
+        await ctx.reply("tracemalloc is not running.", mention_author=False)
+        return
+
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    snapshot_path = _dump_path("tracemalloc", "snapshot")
+    snapshot.dump(snapshot_path)
+
+    summary_path = _dump_path("tracemalloc", "txt")
+    with open(summary_path, "w") as outfile:
+        for stat in snapshot.statistics("lineno")[:amount]:
+            outfile.write("{0}\n".format(stat))
+
+    logger.info("wrote tracemalloc snapshot to {0}".format(snapshot_path))
+    await ctx.reply("snapshot written to {0}".format(snapshot_path), mention_author=False)
+
+
+@bot.command("slow-callbacks", ignore_extra=False)
+@commands.is_owner()
+async def slow_callbacks(ctx, threshold: float=0.0):
+    """
+    Logs every callback or handler that blocks the event loop for longer than the threshold in
+    seconds, a threshold of 0 turns the reporting off again.
+
+    This puts the event loop in asyncio debug mode, which has some overhead of its own.
+    """
+    if threshold < 0:
+        await ctx.reply(
+            "{0} threshold must be 0 or more.".format(ctx.author.mention), mention_author=False
+        )
+        return
+
+    loop = asyncio.get_event_loop()
+    if threshold == 0:
+        loop.set_debug(False)
+        logger.info("disabled slow callback reporting")
+        await ctx.reply("slow callback reporting disabled.", mention_author=False)
+        return
+
+    # asyncio logs the slow callbacks as warnings on its own 'asyncio' logger.
+    loop.slow_callback_duration = threshold
+    loop.set_debug(True)
+    logger.info("enabled slow callback reporting for callbacks over {0}s".format(threshold))
+    await ctx.reply("reporting callbacks blocking longer than {0}s.".format(threshold), mention_author=False)
+
+
 # Mass delete reaction tools.
 
 
@@ -96,53 +281,122 @@ async def purge_reactions_of_user(ctx, user: discord.User, amount: int=100):
             await reaction.remove(user)
 
 
+def _reaction_name(reaction):
+    if isinstance(reaction.emoji, str):
+        # Unicode emoji.
+        return reaction.emoji
+    # Emoji or PartialEmoji
+    return reaction.emoji.name
+
+
+def _paginate(amount, page_size=MENU_PAGE_SIZE):
+    """Split the indices of amount items into pages.
+    Args:
+        amount (int): amount of items to paginate.
+        page_size (int): maximum amount of items per page.
+    Returns:
+        [[int]]: indices of the items on each page.
+    """
+    return [list(range(i, min(i + page_size, amount))) for i in range(0, amount, page_size)]
+
+
+def _format_reaction_menu(reactions, pages, page, selected):
+    """Format the purge-message-reactions menu for the given page.
+    Args:
+        reactions ([discord.Reaction]): all the reactions on the message.
+        pages ([[int]]): reaction indices per page, see _paginate.
+        page (int): page to show.
+        selected (set): indices of the selected reactions.
+    Returns:
+        str: the menu message.
+    """
+    msg = "React to the letters of the emotes to purge and {0} to purge them:\n```\n".format(MENU_CONFIRM)
+    for letter, index in zip(string.ascii_lowercase, pages[page]):
+        msg += "{0} {1} - {2}\n".format("*" if index in selected else " ", letter, _reaction_name(reactions[index]))
+    msg += "```"
+
+    if len(pages) > 1:
+        msg += "page {0}/{1}, {2} selected in total.".format(page + 1, len(pages), len(selected))
+    return msg
+
+
+async def _add_reactions(message, emojis):
+    # Fire the adds at once instead of a round-trip each, discord.py queues them on the same
+    # rate limit bucket in order.
+    await asyncio.gather(*(message.add_reaction(emoji) for emoji in emojis))
+
+
 @bot.command("purge-message-reactions", ignore_extra=False)
 @commands.is_owner()
 async def purge_reactions_of_message(ctx, message: discord.Message):
     """
-    Purges all reactions of a certain emote of a given message. This tool is mostly handy to remove
-    the reaction of a banner or deleted account as that cannot be removed to the discord interface.
+    Purges all reactions of one or more emotes of a given message. This tool is mostly handy to
+    remove the reaction of a banned or deleted account as that cannot be removed through the
+    discord interface.
 
-    It uses a fancy setup menu to select which emote to purge.
+    It uses a fancy setup menu to select which emotes to purge, paginated as a message can only
+    have 20 distinct reactions.
     """
     if not message.reactions:
         await ctx.reply("message has no reactions to purge.", mention_author=False)
         return
 
-    msg = "React to the letter for the emote to purge:\n```\n"
+    reactions = list(message.reactions)
+    pages = _paginate(len(reactions))
+    page = 0
+    selected = set()
 
-    alphabet = list(string.ascii_lowercase)
-    reaction_mapping = OrderedDict()
+    def page_emojis():
+        letters = [REGIONAL_EMOJI_STRINGS[letter] for letter in string.ascii_lowercase[:len(pages[page])]]
+        controls = [MENU_PREVIOUS, MENU_NEXT, MENU_CONFIRM] if len(pages) > 1 else [MENU_CONFIRM]
+        return letters + controls
 
-    for reaction in message.reactions:
-        letter = alphabet.pop(0)
-        reaction_mapping[REGIONAL_EMOJI_STRINGS[letter]] = reaction
-
-        if isinstance(reaction.emoji, str):
-            # Unicode emoji.
-            msg +=  letter + " - " + reaction.emoji + "\n"
-        else:
-            # Emoji or PartialEmoji
-            msg +=  letter + " - " + reaction.emoji.name + "\n"
-
-    msg += "```"
-
-    menu_message = await ctx.send(msg)
-    for key in reaction_mapping.keys():
-        await menu_message.add_reaction(key)
+    menu_message = await ctx.send(_format_reaction_menu(reactions, pages, page, selected))
+    await _add_reactions(menu_message, page_emojis())
 
     def check(reaction, user):
-        return reaction.message == menu_message and user == ctx.author and \
-            str(reaction.emoji) in reaction_mapping
-
-    try:
-        reaction, _ = await bot.wait_for("reaction_add", check=check, timeout=20.0)
-    except asyncio.TimeoutError:
-        await message.reply("command timed out; you have 20 seconds to select which emote to remove.", mention_author=False)
-        return
+        return reaction.message.id == menu_message.id and user == ctx.author and \
+            str(reaction.emoji) in page_emojis()
+
+    while True:
+        try:
+            reaction, user = await bot.wait_for("reaction_add", check=check, timeout=MENU_TIMEOUT)
+        except asyncio.TimeoutError:
+            await asyncio.gather(
+                menu_message.edit(content="command timed out; you have {0} seconds per selection.".format(int(MENU_TIMEOUT))),
+                menu_message.clear_reactions(),
+            )
+            return
+
+        emoji = str(reaction.emoji)
+        if emoji == MENU_CONFIRM:
+            if selected:
+                break
+            await menu_message.remove_reaction(emoji, user)
+            continue
+
+        if emoji in (MENU_PREVIOUS, MENU_NEXT):
+            page = (page + (1 if emoji == MENU_NEXT else -1)) % len(pages)
+            await menu_message.clear_reactions()
+            await asyncio.gather(
+                menu_message.edit(content=_format_reaction_menu(reactions, pages, page, selected)),
+                _add_reactions(menu_message, page_emojis()),
+            )
+            continue
+
+        # Toggle the letter and take the reaction away again so it can be toggled back.
+        index = pages[page][page_emojis().index(emoji)]
+        selected ^= {index}
+        await asyncio.gather(
+            menu_message.edit(content=_format_reaction_menu(reactions, pages, page, selected)),
+            menu_message.remove_reaction(emoji, user),
+        )
 
-    await reaction_mapping[reaction.emoji].clear()
+    targets = [reactions[index] for index in sorted(selected)]
+    await asyncio.gather(
+        menu_message.clear_reactions(),
+        *(reaction.clear() for reaction in targets)
+    )
     await menu_message.edit(
-        content="cleared {0}".format(reaction.emoji if isinstance(reaction.emoji, str) else reaction.emoji.name)
+        content="cleared {0}".format(", ".join(_reaction_name(reaction) for reaction in targets))
     )
-    await menu_message.clear_reactions()
@@ -0,0 +1,222 @@
+"""
+Capture of member joins so they can be replayed offline against the EntryBanner patterns, without
+being connected to discord. A capture is a JSONL file with one join per line, replay it with:
+
+    python -m ikabot.capture <capture file> <entrybanner json file>
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from collections import Counter, namedtuple
+
+from ikabot.entrybanner import GuildEntryBanner, MemberMatcher
+
+
+logger = logging.getLogger(__name__)
+
+
+# Stand-ins for the discord objects GuildEntryBanner needs during a replay.
+ReplayGuild = namedtuple("ReplayGuild", ["id"])
+ReplayMember = namedtuple("ReplayMember", ["id", "name", "discriminator", "avatar", "guild"])
+
+
+class JoinRecorder(object):
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, backup_count=5, flush_interval=1.0):
+        """Appends joins to a capture file, rotating it like logging's RotatingFileHandler. Writes are
+        buffered so a raid does not cost a write per join, but a join never sits in the buffer for
+        longer than flush_interval while an event loop is running.
+        Args:
+            path (str): capture file to write to.
+            max_bytes (int): size after which the capture gets rotated.
+            backup_count (int): amount of rotated captures (path.1, path.2, ..) to keep.
+            flush_interval (float): maximum amount of seconds a join is kept in the buffer.
+        """
+        self.__path = path
+        self.__max_bytes = max_bytes
+        self.__backup_count = backup_count
+        self.__flush_interval = flush_interval
+        self.__file = None
+        self.__size = 0
+        self.__last_flush = float("-inf")
+        # Scheduled flush of the joins written since the last flush, None if there is none.
+        self.__flush_handle = None
+
+    def record(self, member, verdict, timestamp=None):
+        """
+        Args:
+            member (discord.Member): member that joined.
+            verdict (int): id of the pattern the member matched, None if it did not match.
+            timestamp (float, optional): unix time of the join, defaults to now.
+        """
+        if self.__file is None:
+            self.__size = os.path.getsize(self.__path) if os.path.exists(self.__path) else 0
+            self.__file = open(self.__path, "ab")
+
+        line = json.dumps({
+            "t": time.time() if timestamp is None else timestamp,
+            "g": member.guild.id,
+            "u": member.id,
+            "n": member.name,
+            "d": member.discriminator,
+            "a": None if member.avatar is None else str(member.avatar),
+            "v": verdict,
+        }, separators=(",", ":")).encode("utf-8") + b"\n"
+        self.__file.write(line)
+
+        # Keep count ourselves, asking the file for its position would flush the buffer.
+        self.__size += len(line)
+        if self.__size >= self.__max_bytes:
+            self._rotate()
+        else:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        elapsed = time.monotonic() - self.__last_flush
+        if elapsed >= self.__flush_interval:
+            self.flush()
+            return
+
+        if self.__flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Not running in the bot, the next join or close flushes it.
+                return
+            self.__flush_handle = loop.call_later(self.__flush_interval - elapsed, self.flush)
+
+    def flush(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+        if self.__file is not None:
+            self.__file.flush()
+        self.__last_flush = time.monotonic()
+
+    def _rotate(self):
+        self.close()
+        for i in range(self.__backup_count - 1, 0, -1):
+            source = "{0}.{1}".format(self.__path, i)
+            if os.path.exists(source):
+                os.replace(source, "{0}.{1}".format(self.__path, i + 1))
+        if self.__backup_count > 0:
+            os.replace(self.__path, "{0}.1".format(self.__path))
+        else:
+            os.remove(self.__path)
+
+    def close(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+def read_records(path):
+    """Yield the join records of a capture file.
+    Args:
+        path (str): capture file to read.
+    """
+    with open(path, encoding="utf-8") as infile:
+        for line in infile:
+            if line.strip():
+                yield json.loads(line)
+
+
+def create_replay_banners(guild_jsons):
+    """Create disconnected GuildEntryBanner's from the entrybanner datastore contents.
+    Args:
+        guild_jsons (iterable): the GuildEntryBanner json of every guild.
+    Returns:
+        dict: guild id to GuildEntryBanner.
+    """
+    banners = dict()
+    for guild_json in guild_jsons:
+        guild = ReplayGuild(guild_json["guild_id"])
+        matchers = [MemberMatcher.create_from_json(p) for p in guild_json["patterns"]]
+        banners[guild.id] = GuildEntryBanner(
+            guild, None, guild_json["enabled"], lambda _: None, matchers=matchers
+        )
+    return banners
+
+
+def replay(records, banners):
+    """Feed the records through the banners as fast as possible.
+    Args:
+        records (iterable): join records as returned by read_records.
+        banners (dict): guild id to GuildEntryBanner, see create_replay_banners.
+    Returns:
+        dict: the totals, decisions per (guild id, verdict), the records whose verdict differs
+            from the recorded one as (record, verdict) and the throughput in joins per second.
+    """
+    decisions = Counter()
+    diffs = list()
+    total = 0
+    skipped = 0
+
+    start = time.perf_counter()
+    for record in records:
+        banner = banners.get(record["g"])
+        if banner is None:
+            skipped += 1
+            continue
+
+        member = ReplayMember(record["u"], record["n"], record["d"], record["a"], banner.guild)
+        # Evaluate at the time of the join so account ages come out the same.
+        verdict = banner.validate_member(member, now=record["t"])
+
+        total += 1
+        decisions[(record["g"], verdict)] += 1
+        if verdict != record["v"]:
+            diffs.append((record, verdict))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "total": total,
+        "skipped": skipped,
+        "decisions": decisions,
+        "diffs": diffs,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+    }
+
+
+def _parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="replay a join capture against entrybanner patterns.")
+    parser.add_argument("capture", help="capture file to replay.")
+    parser.add_argument("data", help="entrybanner json datastore with the patterns to replay against.")
+    parser.add_argument(
+        "--diffs", type=int, default=20,
+        help="maximum amount of differing joins to print.",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+
+    with open(args.data) as infile:
+        banners = create_replay_banners(json.load(infile).values())
+
+    report = replay(read_records(args.capture), banners)
+
+    print("replayed {0} joins in {1:.3f}s ({2:.0f} joins/s), skipped {3} of unknown guilds".format(
+        report["total"], report["elapsed"], report["throughput"], report["skipped"]
+    ))
+    for (guild_id, verdict), amount in sorted(report["decisions"].items(), key=str):
+        print("  guild {0}: {1} -> {2}".format(
+            guild_id, "no match" if verdict is None else "pattern {0}".format(verdict), amount
+        ))
+
+    print("{0} joins differ from the recorded outcome".format(len(report["diffs"])))
+    for record, verdict in report["diffs"][:args.diffs]:
+        print("  {0}#{1} ({2}) in {3}: recorded {4}, now {5}".format(
+            record["n"], record["d"], record["u"], record["g"], record["v"], verdict
+        ))
@@ -1,109 +1,346 @@
+import asyncio
+import bisect
+import hashlib
 import json
 import logging
-import os
 import re
+import string
+import time
 
+from collections import OrderedDict
 from datetime import datetime, timezone
 
+import discord
 from discord.ext import commands
 
+from ikabot.guildconfig import (
+    GuildConfig, GuildConfigCog, GuildConfigCommandError, GuildConfigError, compile_pattern, create_new_metadata,
+)
 
 logger = logging.getLogger(__name__)
 
+# Discord ids are snowflakes, the top bits are the creation time in milliseconds since 2015-01-01.
+DISCORD_EPOCH = 1420070400000
 
-class EntryBannerError(Exception):
-    pass
+# Members banned per request by ban-since, the maximum the bulk ban endpoint accepts.
+BAN_BATCH_SIZE = 200
+# Seconds to wait between ban batches, on top of the rate limiting discord.py does itself.
+BAN_BATCH_DELAY = 1.0
+
+DURATION_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
 
 
-class InvalidMatcherId(EntryBannerError):
+class EntryBannerError(GuildConfigError):
     pass
 
 
-class NoLogChannelConfigured(EntryBannerError):
+class EntryBannerCogError(EntryBannerError, GuildConfigCommandError):
     pass
 
 
-class EntryBannerCogError(EntryBannerError):
+def parse_duration(duration_str):
+    """Parse a duration like '90', '30m' or '7d' into seconds.
+    Args:
+        duration_str (str): amount optionally followed by one of the DURATION_UNITS.
+    Raises:
+        EntryBannerCogError: raised if the string is not a valid duration.
+    Returns:
+        int: duration in seconds.
+    """
+    multiplier = DURATION_UNITS.get(duration_str[-1:], None)
+    amount = duration_str[:-1] if multiplier else duration_str
+    if not amount.isdigit():
+        raise EntryBannerCogError("error; invalid duration '{0}', use e.g. 90s, 30m, 12h or 7d.".format(duration_str))
+    return int(amount) * (multiplier or 1)
+
+
+def parse_since(since_str, now=None):
+    """Parse the start of a time window, either a duration ago like '30m' or an ISO timestamp.
+    Args:
+        since_str (str): duration or ISO timestamp, timestamps without a timezone are UTC.
+        now (float, optional): unix timestamp durations are relative to, defaults to now.
+    Raises:
+        EntryBannerCogError: raised if the string is neither.
+    Returns:
+        float: unix timestamp of the start of the window.
+    """
+    try:
+        since = datetime.fromisoformat(since_str)
+    except ValueError:
+        return (time.time() if now is None else now) - parse_duration(since_str)
 
-   def __init__(self, message):
-        self.message = message
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since.timestamp()
 
 
-class EntryBannerDataStore(object):
-    """
-    The 'datastore', bit silly in that we just use a simple json file and constantly
-    need to flush all the data to be consistent but 'good enough for now'. At least
-    this implementation separates the loading/storing of the rest of the classes and
-    they just need to be able to return a proper json representation.
+def joined_timestamp(member):
+    """Unix timestamp the member joined at, discord.py hands out naive UTC datetimes."""
+    joined_at = member.joined_at
+    if joined_at is None:
+        return time.time()
+    if joined_at.tzinfo is None:
+        joined_at = joined_at.replace(tzinfo=timezone.utc)
+    return joined_at.timestamp()
+
 
-    TODO: replace with a proper database/ORM backend.
+class JoinIndex(object):
+    """
+    Member ids of a guild ordered by the time they joined, guild.members has no order so
+    this keeps one to look up everyone that joined in a window.
     """
 
-    def __init__(self, json_path):
-        self.__json_path = json_path
-        self.__json = None
+    def __init__(self):
+        # Sorted (joined timestamp, member id) pairs and member id to joined timestamp.
+        self.__entries = list()
+        self.__joined = dict()
+
+    @classmethod
+    def from_members(cls, members):
+        """Build the index in one go, cheaper than adding the members one by one.
+        Args:
+            members ([discord.Member]): members to index.
+        Returns:
+            JoinIndex: the index.
+        """
+        index = cls()
+        index.__joined = {member.id: joined_timestamp(member) for member in members}
+        index.__entries = sorted((timestamp, member_id) for member_id, timestamp in index.__joined.items())
+        return index
+
+    def add(self, member_id, timestamp):
+        self.remove(member_id)
+        self.__joined[member_id] = timestamp
+        entry = (timestamp, member_id)
+        # Joins nearly always arrive in order, avoid the bisect for those.
+        if not self.__entries or self.__entries[-1] <= entry:
+            self.__entries.append(entry)
+        else:
+            bisect.insort(self.__entries, entry)
+
+    def remove(self, member_id):
+        timestamp = self.__joined.pop(member_id, None)
+        if timestamp is None:
+            return
+        i = bisect.bisect_left(self.__entries, (timestamp, member_id))
+        del self.__entries[i]
+
+    def since(self, timestamp):
+        """
+        Args:
+            timestamp (float): unix timestamp of the start of the window.
+        Returns:
+            [int]: ids of the members that joined at or after the timestamp, in join order.
+        """
+        i = bisect.bisect_left(self.__entries, (timestamp,))
+        return [member_id for _, member_id in self.__entries[i:]]
 
-    def load(self):
-        if self.__json:
-            return self.__json
+    def __len__(self):
+        return len(self.__entries)
 
-        self.__json = dict()
-        if os.path.exists((self.__json_path)):
-            with open(self.__json_path) as infile:
-                json_data = json.load(infile)
 
-            for k, v in json_data.items():
-                # json only allows key names to be strings, so we need to convert
-                # it back to int so we can keep using the key as the guild id.s
-                self.__json[int(k)] = v
+class MemberPredicate(object):
+    """
+    Cheap check on a member that a MemberMatcher requires to pass before it bothers running its
+    regex. The predicates of a matcher are run in order of COST so the cheapest reject wins.
+    """
 
-    def get(self):
-        if self.__json:
-            return self.__json
+    TYPE = None
+    COST = 0
+    # Member attributes besides the name this predicate looks at, these end up in the verdict
+    # cache key of the guilds using it.
+    MEMBER_FIELDS = ()
 
-        self.load()
-        return self.__json
+    def json(self):
+        return {"type": self.TYPE}
 
-    def update(self, guild_entry):
-        """Update the datastore with the given guild state.
+    def __call__(self, member, now):
+        """
         Args:
-            guild_entry (GuildEntryBanner): the guild whose data just got updated
+            member (discord.Member): member to check.
+            now (float): unix timestamp to consider the current time, None for the actual time.
+        Returns:
+            bool: true if the member passes this predicate.
         """
-        self.__json[guild_entry.guild.id] = guild_entry.json()
-        self.__store()
+        raise NotImplementedError()
+
+
+class DefaultAvatarPredicate(MemberPredicate):
+    """Passes members that did not set an avatar."""
+
+    TYPE = "default_avatar"
+    COST = 0
+    MEMBER_FIELDS = ("avatar",)
+
+    @staticmethod
+    def create_from_json(data_dict):
+        return DefaultAvatarPredicate()
+
+    def __call__(self, member, now):
+        return member.avatar is None
+
+    def __str__(self):
+        return "avatar"
+
+
+class AccountAgePredicate(MemberPredicate):
+    """Passes members whose account is at most max_age seconds old, decoded from their id."""
+
+    TYPE = "account_age"
+    COST = 1
+    MEMBER_FIELDS = ("id",)
+
+    def __init__(self, max_age):
+        self.__max_age = max_age
+
+    def json(self):
+        return {"type": self.TYPE, "max_age": self.__max_age}
+
+    @staticmethod
+    def create_from_json(data_dict):
+        return AccountAgePredicate(data_dict["max_age"])
 
-    def __store(self):
-        with open(self.__json_path, "w") as outfile:
-            json.dump(self.__json, outfile, indent=4)
+    def __call__(self, member, now):
+        if now is None:
+            now = time.time()
+        created_at = ((member.id >> 22) + DISCORD_EPOCH) / 1000
+        return now - created_at <= self.__max_age
+
+    def __str__(self):
+        return "age:{0}s".format(self.__max_age)
+
+
+class NameLengthPredicate(MemberPredicate):
+    """Passes members with a name length in the inclusive [min_length, max_length] range."""
+
+    TYPE = "name_length"
+    COST = 2
+
+    def __init__(self, min_length, max_length):
+        self.__min_length = min_length
+        self.__max_length = max_length
+
+    def json(self):
+        return {"type": self.TYPE, "min_length": self.__min_length, "max_length": self.__max_length}
+
+    @staticmethod
+    def create_from_json(data_dict):
+        return NameLengthPredicate(data_dict["min_length"], data_dict["max_length"])
+
+    def __call__(self, member, now):
+        return self.__min_length <= len(member.name) <= self.__max_length
+
+    def __str__(self):
+        return "length:{0}-{1}".format(self.__min_length, self.__max_length)
+
+
+class NameCharsetPredicate(MemberPredicate):
+    """Passes members whose name only consists of the characters of the named charset."""
+
+    TYPE = "name_charset"
+    COST = 3
+
+    CHARSETS = {
+        "alnum": string.ascii_letters + string.digits,
+        "alpha": string.ascii_letters,
+        "lower": string.ascii_lowercase,
+        "digits": string.digits,
+        "ascii": string.printable,
+    }
+
+    def __init__(self, charset):
+        self.__charset = charset
+        self.__chars = frozenset(self.CHARSETS[charset])
+
+    def json(self):
+        return {"type": self.TYPE, "charset": self.__charset}
+
+    @staticmethod
+    def create_from_json(data_dict):
+        return NameCharsetPredicate(data_dict["charset"])
+
+    def __call__(self, member, now):
+        return self.__chars.issuperset(member.name)
+
+    def __str__(self):
+        return "charset:{0}".format(self.__charset)
+
+
+PREDICATE_TYPES = {
+    cls.TYPE: cls for cls in
+    (DefaultAvatarPredicate, AccountAgePredicate, NameLengthPredicate, NameCharsetPredicate)
+}
+
+
+def create_predicate_from_json(data_dict):
+    return PREDICATE_TYPES[data_dict["type"]].create_from_json(data_dict)
+
+
+def parse_predicate(spec):
+    """Parse a predicate from its command form; 'avatar', 'age:7d', 'length:4-12' or 'charset:alnum'.
+    Args:
+        spec (str): predicate specification.
+    Raises:
+        EntryBannerCogError: raised if the specification is invalid.
+    Returns:
+        MemberPredicate: the parsed predicate.
+    """
+    name, _, value = spec.partition(":")
+    if name == "avatar" and not value:
+        return DefaultAvatarPredicate()
+
+    if name == "age":
+        return AccountAgePredicate(parse_duration(value))
+
+    if name == "length":
+        min_length, _, max_length = value.partition("-")
+        if min_length.isdigit() and max_length.isdigit() and int(min_length) <= int(max_length):
+            return NameLengthPredicate(int(min_length), int(max_length))
+
+    if name == "charset" and value in NameCharsetPredicate.CHARSETS:
+        return NameCharsetPredicate(value)
+
+    raise EntryBannerCogError(
+        "error; invalid predicate '{0}', use avatar, age:<duration>, length:<min>-<max> or charset:<{1}>.".format(
+            spec, "|".join(sorted(NameCharsetPredicate.CHARSETS))
+        )
+    )
 
 
 class MemberMatcher(object):
 
-    def __init__(self, pattern, enabled, metadata):
+    def __init__(self, pattern, enabled, metadata, predicates=None):
         """Accepts a member and returns if it matches the conditions of this matcher.
         Args:
             pattern (re.Pattern): pattern to match the members name to.
             enabled (bool): is this matcher enabled.
             metadata (dict): dict of additional metadata.
+            predicates ([MemberPredicate], optional): predicates the member needs to pass before
+                the pattern is tried.
         """
         self.__pattern = pattern
         self.__enabled = enabled
         self.__metadata = metadata or dict()
+        self.__predicates = sorted(predicates or list(), key=lambda p: p.COST)
 
     @staticmethod
     def create_new_metadata(ctx):
-        return {
-            "created_by": "{0}#{1}".format(ctx.author.name, ctx.author.discriminator),
-            "created_by_id": str(ctx.author.id),
-            "created_at": str(datetime.now(timezone.utc)),
-            "banned_ids": list(),
-        }
+        metadata = create_new_metadata(ctx)
+        metadata["banned_ids"] = list()
+        return metadata
 
     def json(self):
         return {
             "pattern": self.__pattern.pattern,
             "enabled": self.__enabled,
             "metadata": self.__metadata,
+            "predicates": [p.json() for p in self.__predicates],
         }
 
     @staticmethod
@@ -111,7 +348,8 @@ class MemberMatcher(object):
         return MemberMatcher(
             re.compile(data_dict["pattern"]),
             data_dict["enabled"],
-            data_dict["metadata"]
+            data_dict["metadata"],
+            predicates=[create_predicate_from_json(p) for p in data_dict.get("predicates", list())],
         )
 
     @property
@@ -124,33 +362,122 @@ class MemberMatcher(object):
     def disable(self):
         self.__enabled = False
 
+    def add_predicate(self, predicate):
+        self.__predicates.append(predicate)
+        self.__predicates.sort(key=lambda p: p.COST)
+
+    def remove_predicate(self, predicate):
+        """Remove the predicate that is equal to the given one.
+        Args:
+            predicate (MemberPredicate): predicate to remove.
+        Returns:
+            bool: true if it was removed, false if this matcher does not have it.
+        """
+        for i, own in enumerate(self.__predicates):
+            if own.json() == predicate.json():
+                del self.__predicates[i]
+                return True
+        return False
+
+    @property
+    def member_fields(self):
+        return set(f for p in self.__predicates for f in p.MEMBER_FIELDS)
+
+    def fingerprint(self):
+        """Everything that influences the outcome of this matcher, metadata excluded."""
+        return {
+            "pattern": self.__pattern.pattern,
+            "flags": self.__pattern.flags,
+            "enabled": self.__enabled,
+            "predicates": [p.json() for p in self.__predicates],
+        }
+
     def add_ban(self, id_):
         # TODO; is not really metadata, refactor when moving to database. Store when they were banned?
         self.__metadata["banned_ids"].append(id_)
 
-    def __call__(self, member):
+    def __call__(self, member, now=None):
         """
         Args:
             member (discord.Member): member to match.
+            now (float, optional): unix timestamp to consider the current time, defaults to the
+                actual time.
         Returns:
             bool: true if it matches, false if not or the matching is disabled.
         """
-        if self.enabled and self.__pattern.match(member.name):
+        if not self.enabled:
+            return False
+
+        for predicate in self.__predicates:
+            if not predicate(member, now):
+                return False
+
+        if self.__pattern.match(member.name):
             return True
         return False
 
     def __str__(self):
-        return str(self.__pattern.pattern)
+        if not self.__predicates:
+            return str(self.__pattern.pattern)
+        return "{0}   [{1}]".format(self.__pattern.pattern, ", ".join(str(p) for p in self.__predicates))
 
     def __repr__(self):
-        return "MemberMatcher(regex={0}, enabled={1}".format(
-            self.__pattern, self.__enabled
+        return "MemberMatcher(regex={0}, enabled={1}, predicates={2})".format(
+            self.__pattern, self.__enabled, self.__predicates
         )
 
 
-class GuildEntryBanner(object):
+class VerdictCache(object):
+
+    def __init__(self, max_size=4096, ttl=60.0):
+        """
+        Bounded LRU cache of member verdicts that expire after ttl seconds. It is shared between
+        all the guilds so raiders joining several guilds with the same patterns only get matched
+        once, the keys are made by GuildEntryBanner.
+        Args:
+            max_size (int): maximum amount of verdicts to keep.
+            ttl (float): seconds a verdict stays valid.
+        """
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """
+        Args:
+            key (tuple): key of the verdict.
+        Returns:
+            (bool, int): if the verdict was found and the verdict itself.
+        """
+        entry = self.__entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return False, None
+
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def store(self, key, verdict):
+        self.__entries[key] = (time.monotonic() + self.__ttl, verdict)
+        self.__entries.move_to_end(key)
+        if len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self.__entries)
+
 
-    def __init__(self, guild, log_channel, enabled, update_callback, matchers=None):
+class GuildEntryBanner(GuildConfig):
+
+    def __init__(self, guild, log_channel, enabled, update_callback, matchers=None, verdict_cache=None):
         """Entry banner for a specific guild.
         Args:
             guild (discord.Guild): guild this banner work for.
@@ -160,210 +487,214 @@ class GuildEntryBanner(object):
             update_callback (callable): method to invoke when the internal data changes,
                 passes on itself as argument.
             matchers ([MemberMatcher], optional): list of MemberMatcher's for this banner.
+            verdict_cache (VerdictCache, optional): cache to look up and store verdicts in.
         """
-        self.__guild = guild
-        self.__log_channel = log_channel
-        self.__enabled = enabled
-        self.__matchers = matchers or list()
-        self.__update_cb = update_callback
-
-    def json(self):
-        return {
-            "guild_id": self.__guild.id,
-            "log_channel_id": self.__log_channel.id if self.__log_channel else None,
-            "enabled": self.__enabled,
-            "patterns": [m.json() for m in self.__matchers],
-        }
+        super().__init__(guild, log_channel, enabled, update_callback, matchers=matchers)
+        self.__verdict_cache = verdict_cache
+        # Version of the current pattern set and the member fields it needs, None when the
+        # patterns changed since they were last computed.
+        self.__pattern_version = None
+        self.__member_fields = ()
+        self.__join_index = None
 
     @staticmethod
-    def create_from_json(bot, update_cb, guild_json):
-        guild_id = guild_json["guild_id"]
-        guild = bot.get_guild(guild_id)
+    def create_from_json(bot, update_cb, guild_json, verdict_cache=None):
+        guild, log_channel = GuildConfig.resolve_guild(bot, guild_json)
         if not guild:
-            logger.error("failed to create GuildEntryBanner for guild id {0}, cannot find guild.".format(
-                guild_id
-            ))
             return None
 
-        log_channel = guild.get_channel(guild_json["log_channel_id"])
-        if not log_channel:
-            logger.error("failed to fetch log channel {0} for guild id {1}, cannot find channel.".format(
-                guild_json["log_channel_id"], guild_id
-            ))
-
         matchers = [MemberMatcher.create_from_json(p) for p in  guild_json["patterns"]]
 
-        return GuildEntryBanner(guild, log_channel, guild_json["enabled"], update_cb, matchers=matchers)
-
-    @property
-    def guild(self):
-        return self.__guild
-
-    @property
-    def log_channel(self):
-        return self.__log_channel
-
-    def set_log_channel(self, channel):
-        self.__log_channel = channel
-        self.__update_cb(self)
-
-    @property
-    def enabled(self):
-        return self.__enabled
-
-    def enable(self):
-        self.__enabled = True
-        self.__update_cb(self)
-
-    def disable(self):
-        self.__enabled = False
-        self.__update_cb(self)
+        return GuildEntryBanner(
+            guild, log_channel, guild_json["enabled"], update_cb, matchers=matchers, verdict_cache=verdict_cache
+        )
 
     # Matchers #
 
-    def validate_matcher_id(self, id_):
-        if id_ < 0 or id_ > len(self.__matchers):
-            raise InvalidMatcherId()
+    def _patterns_changed(self):
+        self.__pattern_version = None
+        super()._patterns_changed()
 
-    def add_matcher(self, matcher):
-        self.__matchers.append(matcher)
-        self.__update_cb(self)
-        # TODO: using the index of a list is kinda naive, replace with a proper hash.
-        # Good enough for first prototype or for user interaction, not for loggin and
-        # auditing purposes.
-        return len(self.__matchers) - 1
-
-    def pop_matcher(self, id_):
+    def add_matcher_predicate(self, id_, predicate):
         self.validate_matcher_id(id_)
-        self.__update_cb(self)
-        return self.__matchers.pop(id_)
+        self._matchers[id_].add_predicate(predicate)
+        self._patterns_changed()
 
-    def enable_matcher(self, id_):
+    def remove_matcher_predicate(self, id_, predicate):
         self.validate_matcher_id(id_)
-        self.__matchers[id_].enable()
-        self.__update_cb(self)
+        if not self._matchers[id_].remove_predicate(predicate):
+            raise EntryBannerCogError("error; pattern {0} does not have predicate {1}.".format(id_, predicate))
+        self._patterns_changed()
 
-    def disable_matcher(self, id_):
-        self.validate_matcher_id(id_)
-        self.__matchers[id_].disable()
-        self.__update_cb(self)
+    def add_ban(self, member, id_):
+        self._matchers[id_].add_ban(member.id)
+        self._update()
 
-    def get_pretty_pattern_list(self):
-        if len(self.__matchers) == 0:
-            return "no patterns have been added yet."
+    # Joins #
 
-        msg = "Current patterns:"
-        for i, matcher in enumerate(self.__matchers):
-            msg += "\n{0}. {1}{2}".format(
-                i, str(matcher), "" if matcher.enabled else "   (disabled)"
-            )
+    @property
+    def join_index(self):
+        """JoinIndex of the guild members, built from the member cache on first use."""
+        if self.__join_index is None:
+            self.build_join_index()
+        return self.__join_index
 
-        return msg
+    def build_join_index(self):
+        """(Re)build the JoinIndex from the member cache."""
+        self.__join_index = JoinIndex.from_members(self.guild.members)
 
-    def add_ban(self, member, id_):
-        self.__matchers[id_].add_ban(member.id)
-        self.__update_cb(self)
+    def members_joined_since(self, timestamp):
+        """
+        Args:
+            timestamp (float): unix timestamp of the start of the window.
+        Returns:
+            ([discord.Member], int): members that joined since the timestamp without any roles and
+                the amount of members that got excluded because they do have roles.
+        """
+        members = list()
+        excluded = 0
+        for member_id in self.join_index.since(timestamp):
+            member = self.guild.get_member(member_id)
+            if member is None:
+                continue
+            # Everyone has the @everyone role.
+            if len(member.roles) > 1:
+                excluded += 1
+                continue
+            members.append(member)
+        return members, excluded
 
     # Matching #
 
-    def validate_member(self, member):
-        assert(self.__guild == member.guild)
+    def validate_member(self, member, now=None):
+        assert(self.guild == member.guild)
         if self.enabled:
-            return self._validate_member(member)
+            return self._validate_member(member, now)
         return None
 
-    def _validate_member(self, member):
-        for id_, matcher in enumerate(self.__matchers):
-            if matcher(member):
+    @property
+    def pattern_version(self):
+        """Hash of the current pattern set, guilds with identical patterns share the same version."""
+        if self.__pattern_version is None:
+            fingerprint = json.dumps([m.fingerprint() for m in self._matchers], sort_keys=True)
+            self.__pattern_version = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+            self.__member_fields = tuple(sorted(set().union(*(m.member_fields for m in self._matchers))))
+        return self.__pattern_version
+
+    def _validate_member(self, member, now=None):
+        # Replays pass their own time which the cached verdicts know nothing about.
+        if self.__verdict_cache is None or now is not None:
+            return self._match_member(member, now)
+
+        version = self.pattern_version
+        key = (version, member.name) + tuple(getattr(member, f) for f in self.__member_fields)
+        found, verdict = self.__verdict_cache.lookup(key)
+        if not found:
+            verdict = self._match_member(member, now)
+            self.__verdict_cache.store(key, verdict)
+        return verdict
+
+    def _match_member(self, member, now=None):
+        for id_, matcher in enumerate(self._matchers):
+            if matcher(member, now):
                 return id_
         return None
 
 
-class EntryBannerCog(commands.Cog):
+class EntryBannerCog(GuildConfigCog):
 
     COMMAND_NAME = "entrybanner"
 
-    def __init__(self, bot, data_store):
-        self.__bot =  bot
-        self.__data_store = data_store
-        self.__guild_mapping = dict()
-        self._load_guild_mapping()
-
-    def _load_guild_mapping(self):
-        for guild_json in self.__data_store.get().values():
-            try:
-                guild_entry = GuildEntryBanner.create_from_json(
-                    self.__bot, self.__data_store.update, guild_json
-                )
-            except Exception as err:
-                # We still keep this guild in the data store, if the guild comes back proper we need
-                # to restart the bot for the data to get loaded. If we don't we will override the guild
-                # data we have with a new instance.
-                # TODO; will be better when moving to a database.
-                logger.exception(
-                    "failed to init guild from the following data: {0}".format(guild_json)
-                )
-                continue
-
-            self.__guild_mapping[guild_entry.guild.id] = guild_entry
-
-    def _init_guild_entry(self, guild):
-        guild_entry = GuildEntryBanner(guild, None, False, self.__data_store.update)
-        self.__data_store.update(guild_entry)
-        return guild_entry
-
-    def _get_guild_entry(self, guild):
-        guild_entry = self.__guild_mapping.get(guild.id)
-        if not guild_entry:
-            logging.info("creating new guild entry for {0}".format(guild.id))
-            guild_entry = self._init_guild_entry(guild)
-            self.__guild_mapping[guild.id] = guild_entry
-
+    def __init__(self, bot, data_store, recorder=None):
+        """
+        Args:
+            bot (commands.Bot): bot this cog is added to.
+            data_store (ikabot.guildconfig.GuildDataStore): datastore of the guild configurations.
+            recorder (ikabot.capture.JoinRecorder, optional): recorder to capture every join with.
+        """
+        self.__recorder = recorder
+        self.__verdict_cache = VerdictCache()
+        # Join handlers that are still running, so shutdown can wait for their bans and writes.
+        self.__pending = set()
+        self.__draining = False
+        super().__init__(bot, data_store)
+
+    def _create_guild_config(self, guild_json):
+        guild_entry = GuildEntryBanner.create_from_json(
+            self.bot, self.data_store.update, guild_json, verdict_cache=self.__verdict_cache
+        )
+        if guild_entry:
+            # The cog gets loaded once the member cache is ready, index it now instead of on the
+            # first ban-since.
+            guild_entry.build_join_index()
         return guild_entry
 
-    # Events #
-
-    async def cog_command_error(self, ctx, error):
-        """Eat all argument failures, our own exceptions and raise exceptions for everything else."""
-        if isinstance(error, commands.errors.CommandInvokeError):
-            original = error.original
+    def _init_guild_config(self, guild):
+        return GuildEntryBanner(
+            guild, None, False, self.data_store.update, verdict_cache=self.__verdict_cache
+        )
 
-            if isinstance(original, InvalidMatcherId):
-                await ctx.reply("invalid pattern id.", mention_author=False)
-                return
+    async def drain(self, timeout):
+        """Stop handling new joins and wait for the in-flight join handlers to finish.
+        Args:
+            timeout (float): maximum amount of seconds to wait.
+        """
+        self.__draining = True
+        if self.__pending:
+            logger.info("waiting for {0} join handler(s) to finish".format(len(self.__pending)))
+            _, pending = await asyncio.wait(set(self.__pending), timeout=timeout)
+            if pending:
+                logger.warning("{0} join handler(s) did not finish within {1}s".format(len(pending), timeout))
 
-            if isinstance(original, NoLogChannelConfigured):
-                await ctx.reply("configure a log channel (set-log-channel) before invoking any commands.", mention_author=False)
-                return
+        if self.__recorder:
+            self.__recorder.close()
 
-            if isinstance(original, EntryBannerCogError):
-                await ctx.reply(error.message, mention_author=False)
-                return
+    # Events #
 
-        if isinstance(error, commands.errors.MissingRequiredArgument) or isinstance(error, commands.errors.BadArgument):
-            await ctx.reply("error; Missing or invalid arguments.", mention_author=False)
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        if self.__draining:
             return
 
-        if isinstance(error, commands.errors.TooManyArguments):
-            await ctx.reply("error; Too many arguments.", mention_author=False)
+        # Do not make a default one if this gets invoked.
+        guild_entry = self._lookup_guild_config(member.guild.id)
+        if not guild_entry:
             return
 
-        if isinstance(error, commands.errors.MissingPermissions):
-            await ctx.reply("error; {0}".format(error.args[0]), mention_author=False)
-            return
+        guild_entry.join_index.add(member.id, joined_timestamp(member))
 
-        await ctx.reply("internal error; If this persists please contact the bot developer.", mention_author=False)
-        logger.error("Unhandled error in '{0}':\n{1}".format(self.COMMAND_NAME, error))
-        raise error
+        task = asyncio.current_task()
+        self.__pending.add(task)
+        try:
+            await self._handle_member_join(guild_entry, member)
+        finally:
+            self.__pending.discard(task)
 
     @commands.Cog.listener()
-    async def on_member_join(self, member):
-        # Do not make a default one if this gets invoked.
-        guild_entry = self.__guild_mapping.get(member.guild.id)
+    async def on_member_remove(self, member):
+        guild_entry = self._lookup_guild_config(member.guild.id)
         if not guild_entry:
             return
 
+        guild_entry.join_index.remove(member.id)
+
+    def _record_join(self, member, matcher_id):
+        # The capture is only a diagnostic, it should never get in the way of banning.
+        try:
+            self.__recorder.record(member, matcher_id)
+        except Exception:
+            logger.exception("failed to capture the join of {0}, disabling join capture".format(member.id))
+            recorder, self.__recorder = self.__recorder, None
+            try:
+                recorder.close()
+            except Exception:
+                logger.exception("failed to close the join capture")
+
+    async def _handle_member_join(self, guild_entry, member):
         matcher_id = guild_entry.validate_member(member)
+        if self.__recorder:
+            self._record_join(member, matcher_id)
+
         if matcher_id is not None:
             if guild_entry.log_channel is None:
                 logger.warning("{0} ({1}) does not have a log channel configured, skipping banning {2} ({3}) / {4} due to pattern {5}.".format(
@@ -390,62 +721,111 @@ class EntryBannerCog(commands.Cog):
     @commands.has_permissions(administrator=True)
     @commands.group(name=COMMAND_NAME)
     async def invoke(self, ctx):
-        if ctx.invoked_subcommand is None:
-            # TODO; add help.
-            await ctx.reply("entrybanner help is here!", mention_author=False)
-            return
-
-        if ctx.invoked_subcommand.name == "set-log-channel":
-            # Always make this command invoke-able as it needed for initial configuration.
-            return
-
-        guild_entry = self._get_guild_entry(ctx.guild)
-        if not guild_entry.log_channel:
-            raise NoLogChannelConfigured()
+        await self._invoke_command(ctx)
 
     # Basic #
 
     @invoke.command(ignore_extra=False)
     async def info(self, ctx):
-        msg = "Enabled: {0}".format(self._get_guild_entry(ctx.guild).enabled)
+        msg = "Enabled: {0}".format(self._get_guild_config(ctx.guild).enabled)
+        msg += "\nVerdict cache: {0} entries, {1:.1%} hit rate".format(
+            len(self.__verdict_cache), self.__verdict_cache.hit_rate
+        )
         # TODO; add more stats.
         await ctx.reply(msg, mention_author=False)
 
     @invoke.command(ignore_extra=False)
     async def enable(self, ctx):
-        self._get_guild_entry(ctx.guild).enable()
-        logger.info("enabled entrybanner for {0} ({1}), done by {2} ({3})".format(
-            ctx.guild.name, ctx.guild.id, "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
-        ))
-        await ctx.reply("{0} has been enabled".format(self.COMMAND_NAME), mention_author=False)
+        await self._enable_command(ctx)
 
-    @invoke.command(ignore_extra=False,)
+    @invoke.command(ignore_extra=False)
     async def disable(self, ctx):
-        self._get_guild_entry(ctx.guild).disable()
-        logger.info("disabled entrybanner for {0} ({1}), done by {2} ({3})".format(
-            ctx.guild.name, ctx.guild.id, "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
-        ))
-        await ctx.reply("{0} has been disabled".format(self.COMMAND_NAME), mention_author=False)
+        await self._disable_command(ctx)
 
     @invoke.command(name="set-log-channel", ignore_extra=False)
     async def set_log_channel(self, ctx, channel: int=None):
-        if channel:
-            # Set either the provided channel id.
-            channel = ctx.guild.get_channel(channel)
-            if not channel:
-                await ctx.reply("invalid channel id.", mention_author=False)
-                return
-        else:
-            # Or set the channel the command is invoked in.
-            channel = ctx.channel
+        await self._set_log_channel_command(ctx, channel)
 
-        self._get_guild_entry(ctx.guild).set_log_channel(channel)
-        logger.info("log channel set to {0} ({1}) in {2} ({3}), done by {4} ({5})".format(
-            ctx.guild.name, ctx.guild.id,
-            channel.name, channel.id,
+    @invoke.command(name="ban-since", ignore_extra=False)
+    async def ban_since(self, ctx, since_str: str):
+        """
+        Bans everyone without roles that joined since the given time, either a duration ago like
+        '30m' or an ISO timestamp in UTC. Shows how many members it will ban and asks to confirm
+        before banning them in batches.
+        """
+        guild_entry = self._get_guild_config(ctx.guild)
+        since = parse_since(since_str)
+        members, excluded = guild_entry.members_joined_since(since)
+        protected = {ctx.author.id, ctx.guild.me.id, ctx.guild.owner_id}
+        members = [m for m in members if m.id not in protected]
+
+        if not members:
+            await ctx.reply("no members without roles joined since then, {0} with roles excluded.".format(excluded), mention_author=False)
+            return
+
+        confirm = "\N{WHITE HEAVY CHECK MARK}"
+        progress = await ctx.reply(
+            "{0} members without roles joined since {1}, {2} with roles excluded. React with {3} to ban them.".format(
+                len(members), datetime.fromtimestamp(since, timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC"),
+                excluded, confirm
+            ),
+            mention_author=False
+        )
+        await progress.add_reaction(confirm)
+
+        def check(reaction, user):
+            return reaction.message.id == progress.id and user == ctx.author and str(reaction.emoji) == confirm
+
+        try:
+            await self.bot.wait_for("reaction_add", check=check, timeout=20.0)
+        except asyncio.TimeoutError:
+            await progress.edit(content="command timed out; nobody got banned.")
+            return
+
+        # Members may have left or been given a role while waiting for the confirmation.
+        members = [m for m in map(ctx.guild.get_member, (m.id for m in members)) if m is not None and len(m.roles) <= 1]
+        if not members:
+            await progress.edit(content="nobody left to ban; everyone left or has been given a role.")
+            return
+
+        logger.info("banning {0} members that joined {1} ({2}) since {3}, done by {4} ({5})".format(
+            len(members), ctx.guild.name, ctx.guild.id, since,
             "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
         ))
-        await ctx.reply("logs will be written to {0}".format(channel.mention), mention_author=False)
+
+        reason = "ban-since {0} by {1}#{2}".format(since_str, ctx.author.name, ctx.author.discriminator)
+        banned = 0
+        failed = 0
+        for i in range(0, len(members), BAN_BATCH_SIZE):
+            if i:
+                await asyncio.sleep(BAN_BATCH_DELAY)
+
+            batch = members[i:i + BAN_BATCH_SIZE]
+            if hasattr(ctx.guild, "bulk_ban"):
+                # Only available from discord.py 2.4 onwards.
+                try:
+                    result = await ctx.guild.bulk_ban(batch, reason=reason, delete_message_seconds=0)
+                except discord.HTTPException:
+                    logger.exception("failed to ban a batch of {0} members from {1}".format(len(batch), ctx.guild.id))
+                    failed += len(batch)
+                else:
+                    banned += len(result.banned)
+                    failed += len(result.failed)
+            else:
+                for member in batch:
+                    try:
+                        await member.ban(reason=reason, delete_message_days=0)
+                        banned += 1
+                    except Exception:
+                        logger.exception("failed to ban {0} from {1}".format(member.id, ctx.guild.id))
+                        failed += 1
+
+            await progress.edit(content="banned {0}/{1} members, {2} failed.".format(banned, len(members), failed))
+
+        await guild_entry.log_channel.send("banned {0} members that joined since {1}, {2} failed; done by {3}.".format(
+            banned, since_str, failed, ctx.author.mention
+        ))
+        logger.info("banned {0} members from {1} ({2}), {3} failed".format(banned, ctx.guild.name, ctx.guild.id, failed))
 
     # Matching #
 
@@ -456,52 +836,43 @@ class EntryBannerCog(commands.Cog):
 
     @pattern.command(name="add", ignore_extra=False)
     async def add_pattern(self, ctx, regex_str: str, enabled: bool=False):
-        try:
-            pattern = re.compile(regex_str)
-        except Exception as err:
-            msg = "error; failed to compile the provided regex:\n{0}".format(str(err))
-            logger.exception("failed to compile regex '{0}'".format(regex_str))
-            raise EntryBannerError(msg)
-
-        matcher = MemberMatcher(pattern, False, MemberMatcher.create_new_metadata(ctx))
-        id_ = self._get_guild_entry(ctx.guild).add_matcher(matcher)
-        logger.info("added pattern {0} ({1}) in {2} ({3}), done by {4} ({5})".format(
-            pattern, id_,
-            ctx.guild.name, ctx.guild.id,
-            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
-        ))
-        await ctx.reply("new pattern has been added with id {0}".format(id_), mention_author=False)
+        pattern = compile_pattern(regex_str)
+        await self._add_pattern_command(ctx, MemberMatcher(pattern, False, MemberMatcher.create_new_metadata(ctx)))
 
     @pattern.command(name="remove", ignore_extra=False)
     async def remove_pattern(self, ctx, id_: int):
-        gb = self._get_guild_entry(ctx.guild)
-        matcher = gb.pop_matcher(id_)
-        logger.info("removed pattern {0} ({1}) in {2} ({3}), done by {4} ({5})".format(
-            matcher, id_,
+        await self._remove_pattern_command(ctx, id_)
+
+    @pattern.command(name="add-predicate", ignore_extra=False)
+    async def add_pattern_predicate(self, ctx, id_: int, predicate_str: str):
+        predicate = parse_predicate(predicate_str)
+        self._get_guild_config(ctx.guild).add_matcher_predicate(id_, predicate)
+        logger.info("added predicate {0} to pattern {1} in {2} ({3}), done by {4} ({5})".format(
+            predicate, id_,
             ctx.guild.name, ctx.guild.id,
             "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
         ))
-        await ctx.reply("removed pattern '{0}'".format(str(matcher)), mention_author=False)
+        await ctx.reply("added predicate {0} to pattern {1}".format(predicate, id_), mention_author=False)
+
+    @pattern.command(name="remove-predicate", ignore_extra=False)
+    async def remove_pattern_predicate(self, ctx, id_: int, predicate_str: str):
+        predicate = parse_predicate(predicate_str)
+        self._get_guild_config(ctx.guild).remove_matcher_predicate(id_, predicate)
+        logger.info("removed predicate {0} from pattern {1} in {2} ({3}), done by {4} ({5})".format(
+            predicate, id_,
+            ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("removed predicate {0} from pattern {1}".format(predicate, id_), mention_author=False)
 
     @pattern.command(name="list", ignore_extra=False)
     async def list_patterns(self, ctx):
-        gb = self._get_guild_entry(ctx.guild)
-        await ctx.reply(gb.get_pretty_pattern_list(), mention_author=False)
+        await self._list_patterns_command(ctx)
 
     @pattern.command(name="enable", ignore_extra=False)
     async def enable_pattern(self, ctx, id_: int):
-        self._get_guild_entry(ctx.guild).enable_matcher(id_)
-        logger.info("enabled pattern {0} in {1} ({2}), done by {3} ({4})".format(
-            id_, ctx.guild.name, ctx.guild.id,
-            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
-        ))
-        await ctx.reply("enabled.", mention_author=False)
+        await self._enable_pattern_command(ctx, id_)
 
     @pattern.command(name="disable", ignore_extra=False)
     async def disable_pattern(self, ctx, id_: int):
-        self._get_guild_entry(ctx.guild).disable_matcher(id_)
-        logger.info("disabled pattern {0} in {1} ({2}), done by {3} ({4})".format(
-            id_, ctx.guild.name, ctx.guild.id,
-            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
-        ))
-        await ctx.reply("disabled.", mention_author=False)
+        await self._disable_pattern_command(ctx, id_)
@@ -0,0 +1,430 @@
+"""
+Shared plumbing for the cogs that keep a configuration with a list of pattern matchers per guild,
+stored in a json datastore and managed through a command group.
+"""
+import json
+import logging
+import os
+import re
+
+from datetime import datetime, timezone
+
+from discord.ext import commands
+
+
+logger = logging.getLogger(__name__)
+
+
+class GuildConfigError(Exception):
+    pass
+
+
+class InvalidMatcherId(GuildConfigError):
+    pass
+
+
+class NoLogChannelConfigured(GuildConfigError):
+    pass
+
+
+class GuildConfigCommandError(GuildConfigError):
+    """Error whose message gets replied to the invoker of the command."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class GuildDataStore(object):
+    """
+    The 'datastore', bit silly in that we just use a simple json file and constantly
+    need to flush all the data to be consistent but 'good enough for now'. At least
+    this implementation separates the loading/storing of the rest of the classes and
+    they just need to be able to return a proper json representation.
+
+    TODO: replace with a proper database/ORM backend.
+    """
+
+    def __init__(self, json_path):
+        self.__json_path = json_path
+        self.__json = None
+
+    def load(self):
+        if self.__json:
+            return self.__json
+
+        self.__json = dict()
+        if os.path.exists((self.__json_path)):
+            with open(self.__json_path) as infile:
+                json_data = json.load(infile)
+
+            for k, v in json_data.items():
+                # json only allows key names to be strings, so we need to convert
+                # it back to int so we can keep using the key as the guild id.s
+                self.__json[int(k)] = v
+
+    def get(self):
+        if self.__json:
+            return self.__json
+
+        self.load()
+        return self.__json
+
+    def update(self, guild_config):
+        """Update the datastore with the given guild state.
+        Args:
+            guild_config (GuildConfig): the guild whose data just got updated
+        """
+        self.__json[guild_config.guild.id] = guild_config.json()
+        self.__store()
+
+    def __store(self):
+        with open(self.__json_path, "w") as outfile:
+            json.dump(self.__json, outfile, indent=4)
+
+
+def create_new_metadata(ctx):
+    """Metadata of a matcher created by the given command invocation."""
+    return {
+        "created_by": "{0}#{1}".format(ctx.author.name, ctx.author.discriminator),
+        "created_by_id": str(ctx.author.id),
+        "created_at": str(datetime.now(timezone.utc)),
+    }
+
+
+def compile_pattern(regex_str):
+    """
+    Args:
+        regex_str (str): regex provided by the invoker of a command.
+    Raises:
+        GuildConfigCommandError: raised if the regex does not compile.
+    Returns:
+        re.Pattern: the compiled regex.
+    """
+    try:
+        return re.compile(regex_str)
+    except Exception as err:
+        logger.exception("failed to compile regex '{0}'".format(regex_str))
+        raise GuildConfigCommandError("error; failed to compile the provided regex:\n{0}".format(str(err)))
+
+
+class GuildConfig(object):
+
+    def __init__(self, guild, log_channel, enabled, update_callback, matchers=None):
+        """Configuration of a cog for a specific guild.
+        Args:
+            guild (discord.Guild): guild this configuration is for.
+            log_channel (discord.TextChannel): channel to send logs to.
+            enabled (bool): is it enabled
+            update_callback (callable): method to invoke when the internal data changes,
+                passes on itself as argument.
+            matchers (list, optional): the matchers of this guild.
+        """
+        self.__guild = guild
+        self.__log_channel = log_channel
+        self.__enabled = enabled
+        self.__matchers = matchers or list()
+        self.__update_cb = update_callback
+
+    def json(self):
+        return {
+            "guild_id": self.__guild.id,
+            "log_channel_id": self.__log_channel.id if self.__log_channel else None,
+            "enabled": self.__enabled,
+            "patterns": [m.json() for m in self.__matchers],
+        }
+
+    @staticmethod
+    def resolve_guild(bot, guild_json):
+        """Look up the guild and log channel of the stored configuration.
+        Args:
+            bot (commands.Bot): bot to look the guild up with.
+            guild_json (dict): json of the configuration.
+        Returns:
+            (discord.Guild, discord.TextChannel): the guild, None if it cannot be found, and the log
+                channel, None if it cannot be found.
+        """
+        guild_id = guild_json["guild_id"]
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            logger.error("failed to load the configuration of guild id {0}, cannot find guild.".format(
+                guild_id
+            ))
+            return None, None
+
+        log_channel = guild.get_channel(guild_json["log_channel_id"])
+        if not log_channel:
+            logger.error("failed to fetch log channel {0} for guild id {1}, cannot find channel.".format(
+                guild_json["log_channel_id"], guild_id
+            ))
+
+        return guild, log_channel
+
+    @property
+    def guild(self):
+        return self.__guild
+
+    @property
+    def log_channel(self):
+        return self.__log_channel
+
+    def set_log_channel(self, channel):
+        self.__log_channel = channel
+        self._update()
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    def enable(self):
+        self.__enabled = True
+        self._update()
+
+    def disable(self):
+        self.__enabled = False
+        self._update()
+
+    def _update(self):
+        self.__update_cb(self)
+
+    # Matchers #
+
+    @property
+    def _matchers(self):
+        return self.__matchers
+
+    def _patterns_changed(self):
+        """Invoked whenever the matchers change, the default just stores the new state."""
+        self._update()
+
+    def validate_matcher_id(self, id_):
+        if id_ < 0 or id_ >= len(self.__matchers):
+            raise InvalidMatcherId()
+
+    def add_matcher(self, matcher):
+        self.__matchers.append(matcher)
+        self._patterns_changed()
+        # TODO: using the index of a list is kinda naive, replace with a proper hash.
+        # Good enough for first prototype or for user interaction, not for loggin and
+        # auditing purposes.
+        return len(self.__matchers) - 1
+
+    def pop_matcher(self, id_):
+        self.validate_matcher_id(id_)
+        matcher = self.__matchers.pop(id_)
+        self._patterns_changed()
+        return matcher
+
+    def enable_matcher(self, id_):
+        self.validate_matcher_id(id_)
+        self.__matchers[id_].enable()
+        self._patterns_changed()
+
+    def disable_matcher(self, id_):
+        self.validate_matcher_id(id_)
+        self.__matchers[id_].disable()
+        self._patterns_changed()
+
+    def get_pretty_pattern_list(self):
+        if len(self.__matchers) == 0:
+            return "no patterns have been added yet."
+
+        msg = "Current patterns:"
+        for i, matcher in enumerate(self.__matchers):
+            msg += "\n{0}. {1}{2}".format(
+                i, str(matcher), "" if matcher.enabled else "   (disabled)"
+            )
+
+        return msg
+
+
+class GuildConfigCog(commands.Cog):
+    """
+    Base of the cogs with a GuildConfig per guild. Subclasses implement the guild config creation
+    and declare their command group, the shared commands can delegate to the *_command methods.
+    """
+
+    COMMAND_NAME = None
+
+    def __init__(self, bot, data_store):
+        """
+        Args:
+            bot (commands.Bot): bot this cog is added to.
+            data_store (GuildDataStore): datastore of the guild configurations.
+        """
+        self.__bot = bot
+        self.__data_store = data_store
+        self.__guild_mapping = dict()
+        self._load_guild_mapping()
+
+    @property
+    def bot(self):
+        return self.__bot
+
+    @property
+    def data_store(self):
+        return self.__data_store
+
+    def _create_guild_config(self, guild_json):
+        """Create the guild config from its json, None if it cannot be created."""
+        raise NotImplementedError()
+
+    def _init_guild_config(self, guild):
+        """Create a new, disabled, guild config."""
+        raise NotImplementedError()
+
+    def _load_guild_mapping(self):
+        for guild_json in self.__data_store.get().values():
+            try:
+                guild_config = self._create_guild_config(guild_json)
+            except Exception:
+                # We still keep this guild in the data store, if the guild comes back proper we need
+                # to restart the bot for the data to get loaded. If we don't we will override the guild
+                # data we have with a new instance.
+                # TODO; will be better when moving to a database.
+                logger.exception(
+                    "failed to init guild from the following data: {0}".format(guild_json)
+                )
+                continue
+
+            if guild_config is None:
+                # Same as above, the guild is gone for now but its data stays in the datastore.
+                continue
+
+            self.__guild_mapping[guild_config.guild.id] = guild_config
+
+    def _lookup_guild_config(self, guild_id):
+        """Guild config of the guild id, None if there is none. Does not create one, for events."""
+        return self.__guild_mapping.get(guild_id)
+
+    def _get_guild_config(self, guild):
+        guild_config = self.__guild_mapping.get(guild.id)
+        if not guild_config:
+            logging.info("creating new {0} configuration for {1}".format(self.COMMAND_NAME, guild.id))
+            guild_config = self._init_guild_config(guild)
+            self.__data_store.update(guild_config)
+            self.__guild_mapping[guild.id] = guild_config
+
+        return guild_config
+
+    # Events #
+
+    async def cog_command_error(self, ctx, error):
+        """Eat all argument failures, our own exceptions and raise exceptions for everything else."""
+        if isinstance(error, commands.errors.CommandInvokeError):
+            original = error.original
+
+            if isinstance(original, InvalidMatcherId):
+                await ctx.reply("invalid pattern id.", mention_author=False)
+                return
+
+            if isinstance(original, NoLogChannelConfigured):
+                await ctx.reply("configure a log channel (set-log-channel) before invoking any commands.", mention_author=False)
+                return
+
+            if isinstance(original, GuildConfigCommandError):
+                await ctx.reply(original.message, mention_author=False)
+                return
+
+        if isinstance(error, commands.errors.MissingRequiredArgument) or isinstance(error, commands.errors.BadArgument):
+            await ctx.reply("error; Missing or invalid arguments.", mention_author=False)
+            return
+
+        if isinstance(error, commands.errors.TooManyArguments):
+            await ctx.reply("error; Too many arguments.", mention_author=False)
+            return
+
+        if isinstance(error, commands.errors.MissingPermissions):
+            await ctx.reply("error; {0}".format(error.args[0]), mention_author=False)
+            return
+
+        await ctx.reply("internal error; If this persists please contact the bot developer.", mention_author=False)
+        logger.error("Unhandled error in '{0}':\n{1}".format(self.COMMAND_NAME, error))
+        raise error
+
+    # Commands #
+
+    async def _invoke_command(self, ctx):
+        if ctx.invoked_subcommand is None:
+            # TODO; add help.
+            await ctx.reply("{0} help is here!".format(self.COMMAND_NAME), mention_author=False)
+            return
+
+        if ctx.invoked_subcommand.name == "set-log-channel":
+            # Always make this command invoke-able as it needed for initial configuration.
+            return
+
+        if not self._get_guild_config(ctx.guild).log_channel:
+            raise NoLogChannelConfigured()
+
+    async def _enable_command(self, ctx):
+        self._get_guild_config(ctx.guild).enable()
+        logger.info("enabled {0} for {1} ({2}), done by {3} ({4})".format(
+            self.COMMAND_NAME, ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("{0} has been enabled".format(self.COMMAND_NAME), mention_author=False)
+
+    async def _disable_command(self, ctx):
+        self._get_guild_config(ctx.guild).disable()
+        logger.info("disabled {0} for {1} ({2}), done by {3} ({4})".format(
+            self.COMMAND_NAME, ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("{0} has been disabled".format(self.COMMAND_NAME), mention_author=False)
+
+    async def _set_log_channel_command(self, ctx, channel):
+        if channel:
+            # Set either the provided channel id.
+            channel = ctx.guild.get_channel(channel)
+            if not channel:
+                await ctx.reply("invalid channel id.", mention_author=False)
+                return
+        else:
+            # Or set the channel the command is invoked in.
+            channel = ctx.channel
+
+        self._get_guild_config(ctx.guild).set_log_channel(channel)
+        logger.info("{0} log channel set to {1} ({2}) in {3} ({4}), done by {5} ({6})".format(
+            self.COMMAND_NAME,
+            channel.name, channel.id,
+            ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("logs will be written to {0}".format(channel.mention), mention_author=False)
+
+    async def _add_pattern_command(self, ctx, matcher):
+        id_ = self._get_guild_config(ctx.guild).add_matcher(matcher)
+        logger.info("added {0} pattern {1} ({2}) in {3} ({4}), done by {5} ({6})".format(
+            self.COMMAND_NAME, matcher, id_,
+            ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("new pattern has been added with id {0}".format(id_), mention_author=False)
+
+    async def _remove_pattern_command(self, ctx, id_):
+        matcher = self._get_guild_config(ctx.guild).pop_matcher(id_)
+        logger.info("removed {0} pattern {1} ({2}) in {3} ({4}), done by {5} ({6})".format(
+            self.COMMAND_NAME, matcher, id_,
+            ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("removed pattern '{0}'".format(str(matcher)), mention_author=False)
+
+    async def _list_patterns_command(self, ctx):
+        await ctx.reply(self._get_guild_config(ctx.guild).get_pretty_pattern_list(), mention_author=False)
+
+    async def _enable_pattern_command(self, ctx, id_):
+        self._get_guild_config(ctx.guild).enable_matcher(id_)
+        logger.info("enabled {0} pattern {1} in {2} ({3}), done by {4} ({5})".format(
+            self.COMMAND_NAME, id_, ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("enabled.", mention_author=False)
+
+    async def _disable_pattern_command(self, ctx, id_):
+        self._get_guild_config(ctx.guild).disable_matcher(id_)
+        logger.info("disabled {0} pattern {1} in {2} ({3}), done by {4} ({5})".format(
+            self.COMMAND_NAME, id_, ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("disabled.", mention_author=False)
@@ -0,0 +1,420 @@
+import asyncio
+import logging
+import re
+import time
+
+from collections import OrderedDict
+
+from discord.ext import commands
+
+from ikabot.guildconfig import (
+    GuildConfig, GuildConfigCog, GuildConfigCommandError, compile_pattern, create_new_metadata,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum amount of messages the bulk delete endpoint accepts at once.
+BULK_DELETE_LIMIT = 100
+
+
+class MessageMatcher(object):
+
+    def __init__(self, keyword, pattern, enabled, metadata):
+        """Accepts message content and returns if it matches the conditions of this matcher.
+        Args:
+            keyword (str): literal that has to be in the message, case insensitive, before the
+                pattern is tried.
+            pattern (re.Pattern): pattern to search the message content for.
+            enabled (bool): is this matcher enabled.
+            metadata (dict): dict of additional metadata.
+        """
+        self.__keyword = keyword.lower()
+        self.__pattern = pattern
+        self.__enabled = enabled
+        self.__metadata = metadata or dict()
+
+    def json(self):
+        return {
+            "keyword": self.__keyword,
+            "pattern": self.__pattern.pattern,
+            "enabled": self.__enabled,
+            "metadata": self.__metadata,
+        }
+
+    @staticmethod
+    def create_from_json(data_dict):
+        return MessageMatcher(
+            data_dict["keyword"],
+            re.compile(data_dict["pattern"]),
+            data_dict["enabled"],
+            data_dict["metadata"]
+        )
+
+    @property
+    def keyword(self):
+        return self.__keyword
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    def enable(self):
+        self.__enabled = True
+
+    def disable(self):
+        self.__enabled = False
+
+    def __call__(self, content, lowered):
+        """
+        Args:
+            content (str): message content to match.
+            lowered (str): the lower cased content, shared between the matchers of a guild.
+        Returns:
+            bool: true if it matches, false if not or the matching is disabled.
+        """
+        if self.enabled and self.__keyword in lowered and self.__pattern.search(content):
+            return True
+        return False
+
+    def __str__(self):
+        return "{0}   [{1}]".format(self.__pattern.pattern, self.__keyword)
+
+    def __repr__(self):
+        return "MessageMatcher(keyword={0}, regex={1}, enabled={2})".format(
+            self.__keyword, self.__pattern, self.__enabled
+        )
+
+
+class DuplicateTracker(object):
+
+    def __init__(self, max_authors=10000):
+        """
+        Keeps track of the last message content of each author to detect them repeating
+        themselves, only remembers the max_authors most recently active authors.
+        Args:
+            max_authors (int): maximum amount of authors to remember.
+        """
+        self.__max_authors = max_authors
+        # (guild id, author id) -> [content hash, repeat count, time of the first message]
+        self.__authors = OrderedDict()
+
+    def check(self, key, content, limit, window, now=None):
+        """Register a message and check if the author exceeded the duplicate limit.
+        Args:
+            key (tuple): (guild id, author id) of the message.
+            content (str): message content.
+            limit (int): amount of identical messages allowed within the window.
+            window (float): seconds the identical messages are counted over.
+            now (float, optional): time of the message, defaults to now.
+        Returns:
+            bool: true if this message is one duplicate too many, never for messages without text
+                like attachment, sticker or embed only messages.
+        """
+        content = content.strip()
+        if not content:
+            return False
+
+        if now is None:
+            now = time.monotonic()
+        content_hash = hash(content)
+
+        entry = self.__authors.get(key)
+        if entry is None or entry[0] != content_hash or now - entry[2] > window:
+            self.__authors[key] = [content_hash, 1, now]
+            self.__authors.move_to_end(key)
+            if len(self.__authors) > self.__max_authors:
+                self.__authors.popitem(last=False)
+            return False
+
+        self.__authors.move_to_end(key)
+        entry[1] += 1
+        return entry[1] > limit
+
+    def __len__(self):
+        return len(self.__authors)
+
+
+class DeleteBatcher(object):
+
+    def __init__(self, delay=1.0, flush_callback=None):
+        """Collects messages to delete and removes them per channel with bulk deletes.
+        Args:
+            delay (float): seconds to collect messages before deleting them.
+            flush_callback (coroutine function, optional): awaited with the channel and the list
+                of messages after they have been deleted.
+        """
+        self.__delay = delay
+        self.__flush_cb = flush_callback
+        # channel id -> (channel, [messages])
+        self.__pending = dict()
+        # Task waiting for the delay to pass, None if no flush is scheduled.
+        self.__timer = None
+        # Flushes that are deleting messages right now.
+        self.__flushes = set()
+
+    def add(self, message):
+        _, messages = self.__pending.setdefault(message.channel.id, (message.channel, list()))
+        messages.append(message)
+        if self.__timer is None:
+            self.__timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.__delay)
+        self.__timer = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self.__pending = self.__pending, dict()
+        flush = asyncio.gather(*(
+            self._delete(channel, messages) for channel, messages in pending.values()
+        ))
+        self.__flushes.add(flush)
+        flush.add_done_callback(self.__flushes.discard)
+        await flush
+
+    async def _delete(self, channel, messages):
+        for i in range(0, len(messages), BULK_DELETE_LIMIT):
+            chunk = messages[i:i + BULK_DELETE_LIMIT]
+            try:
+                if len(chunk) == 1:
+                    await chunk[0].delete()
+                else:
+                    await channel.delete_messages(chunk)
+            except Exception:
+                logger.exception("failed to delete {0} message(s) in {1}".format(len(chunk), channel.id))
+                continue
+
+            if self.__flush_cb:
+                # Logging the deletes should never stop the remaining chunks from being deleted.
+                try:
+                    await self.__flush_cb(channel, chunk)
+                except Exception:
+                    logger.exception("failed to report {0} deleted message(s) in {1}".format(len(chunk), channel.id))
+
+    async def drain(self):
+        """Delete everything that is queued right away and wait for the running flushes."""
+        if self.__timer is not None:
+            # Still waiting for the delay, nothing got taken out of the queue yet.
+            self.__timer.cancel()
+            self.__timer = None
+        await self.flush()
+        if self.__flushes:
+            await asyncio.wait(set(self.__flushes))
+
+
+class GuildMessageFilter(GuildConfig):
+
+    def __init__(self, guild, log_channel, enabled, update_callback, matchers=None,
+                 duplicate_limit=0, duplicate_window=30.0):
+        """Message filter for a specific guild.
+        Args:
+            guild (discord.Guild): guild this filter works for.
+            log_channel (discord.TextChannel): channel to send logs to.
+            enabled (bool): is it enabled
+            update_callback (callable): method to invoke when the internal data changes,
+                passes on itself as argument.
+            matchers ([MessageMatcher], optional): list of MessageMatcher's for this filter.
+            duplicate_limit (int, optional): amount of identical messages an author may post within
+                the duplicate window, 0 disables the duplicate detection.
+            duplicate_window (float, optional): seconds duplicate messages are counted over.
+        """
+        super().__init__(guild, log_channel, enabled, update_callback, matchers=matchers)
+        self.__duplicate_limit = duplicate_limit
+        self.__duplicate_window = duplicate_window
+
+    def json(self):
+        data = super().json()
+        data["duplicate_limit"] = self.__duplicate_limit
+        data["duplicate_window"] = self.__duplicate_window
+        return data
+
+    @staticmethod
+    def create_from_json(bot, update_cb, guild_json):
+        guild, log_channel = GuildConfig.resolve_guild(bot, guild_json)
+        if not guild:
+            return None
+
+        matchers = [MessageMatcher.create_from_json(p) for p in guild_json["patterns"]]
+
+        return GuildMessageFilter(
+            guild, log_channel, guild_json["enabled"], update_cb, matchers=matchers,
+            duplicate_limit=guild_json["duplicate_limit"], duplicate_window=guild_json["duplicate_window"],
+        )
+
+    @property
+    def duplicate_limit(self):
+        return self.__duplicate_limit
+
+    @property
+    def duplicate_window(self):
+        return self.__duplicate_window
+
+    def set_duplicate_limit(self, limit, window):
+        self.__duplicate_limit = limit
+        self.__duplicate_window = window
+        self._update()
+
+    # Matching #
+
+    def validate_content(self, content):
+        """
+        Args:
+            content (str): message content to match.
+        Returns:
+            int: id of the first matching pattern, None if none matched or the filter is disabled.
+        """
+        matchers = self._matchers
+        if not self.enabled or not matchers:
+            return None
+
+        lowered = content.lower()
+        for id_, matcher in enumerate(matchers):
+            if matcher(content, lowered):
+                return id_
+        return None
+
+
+class MessageFilterCog(GuildConfigCog):
+
+    COMMAND_NAME = "message-filter"
+
+    def __init__(self, bot, data_store):
+        """
+        Args:
+            bot (commands.Bot): bot this cog is added to.
+            data_store (ikabot.guildconfig.GuildDataStore): datastore of the guild configurations.
+        """
+        self.__duplicates = DuplicateTracker()
+        self.__deletes = DeleteBatcher(flush_callback=self._log_deletes)
+        self.__draining = False
+        super().__init__(bot, data_store)
+
+    def _create_guild_config(self, guild_json):
+        return GuildMessageFilter.create_from_json(self.bot, self.data_store.update, guild_json)
+
+    def _init_guild_config(self, guild):
+        return GuildMessageFilter(guild, None, False, self.data_store.update)
+
+    async def drain(self, timeout):
+        """Stop handling new messages and delete the messages that are still queued.
+        Args:
+            timeout (float): maximum amount of seconds to wait.
+        """
+        self.__draining = True
+        try:
+            await asyncio.wait_for(self.__deletes.drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("queued message deletes did not finish within {0}s".format(timeout))
+
+    async def _log_deletes(self, channel, messages):
+        guild_filter = self._lookup_guild_config(channel.guild.id)
+        if guild_filter is None or guild_filter.log_channel is None:
+            return
+
+        authors = sorted(set("{0}#{1} ({2})".format(m.author.name, m.author.discriminator, m.author.id) for m in messages))
+        await guild_filter.log_channel.send("deleted {0} message(s) in {1} from {2}.".format(
+            len(messages), channel.mention, ", ".join(authors)
+        ))
+
+    # Events #
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        # This gets invoked for every message the bot sees, keep the common path cheap.
+        if self.__draining or message.guild is None or message.author.bot:
+            return
+
+        guild_filter = self._lookup_guild_config(message.guild.id)
+        if guild_filter is None or not guild_filter.enabled:
+            return
+
+        content = message.content
+        matcher_id = guild_filter.validate_content(content)
+        if matcher_id is not None:
+            logger.debug("deleting message {0} of {1} in {2} due to pattern {3}".format(
+                message.id, message.author.id, message.guild.id, matcher_id
+            ))
+            self.__deletes.add(message)
+            return
+
+        if guild_filter.duplicate_limit and self.__duplicates.check(
+            (message.guild.id, message.author.id), content,
+            guild_filter.duplicate_limit, guild_filter.duplicate_window,
+        ):
+            logger.debug("deleting duplicate message {0} of {1} in {2}".format(
+                message.id, message.author.id, message.guild.id
+            ))
+            self.__deletes.add(message)
+
+    # Commands #
+
+    @commands.has_permissions(administrator=True)
+    @commands.group(name=COMMAND_NAME)
+    async def invoke(self, ctx):
+        await self._invoke_command(ctx)
+
+    # Basic #
+
+    @invoke.command(ignore_extra=False)
+    async def info(self, ctx):
+        guild_filter = self._get_guild_config(ctx.guild)
+        msg = "Enabled: {0}\nDuplicate limit: {1}".format(
+            guild_filter.enabled,
+            "{0} per {1}s".format(guild_filter.duplicate_limit, guild_filter.duplicate_window)
+            if guild_filter.duplicate_limit else "disabled"
+        )
+        await ctx.reply(msg, mention_author=False)
+
+    @invoke.command(ignore_extra=False)
+    async def enable(self, ctx):
+        await self._enable_command(ctx)
+
+    @invoke.command(ignore_extra=False)
+    async def disable(self, ctx):
+        await self._disable_command(ctx)
+
+    @invoke.command(name="set-log-channel", ignore_extra=False)
+    async def set_log_channel(self, ctx, channel: int=None):
+        await self._set_log_channel_command(ctx, channel)
+
+    @invoke.command(name="duplicates", ignore_extra=False)
+    async def set_duplicates(self, ctx, limit: int, window: float=30.0):
+        if limit < 0 or window <= 0:
+            raise GuildConfigCommandError("error; limit and window must be positive numbers.")
+
+        self._get_guild_config(ctx.guild).set_duplicate_limit(limit, window)
+        logger.info("message filter duplicate limit set to {0} per {1}s in {2} ({3}), done by {4} ({5})".format(
+            limit, window,
+            ctx.guild.name, ctx.guild.id,
+            "{0}#{1}".format(ctx.author.name, ctx.author.discriminator), ctx.author.id
+        ))
+        await ctx.reply("duplicate limit set to {0} per {1}s.".format(limit, window), mention_author=False)
+
+    # Matching #
+
+    @invoke.group(name="pattern", invoke_without_command=True)
+    async def pattern(self, ctx):
+        await ctx.reply("match help is here!", mention_author=False)
+
+    @pattern.command(name="add", ignore_extra=False)
+    async def add_pattern(self, ctx, keyword: str, regex_str: str):
+        pattern = compile_pattern(regex_str)
+        await self._add_pattern_command(ctx, MessageMatcher(keyword, pattern, False, create_new_metadata(ctx)))
+
+    @pattern.command(name="remove", ignore_extra=False)
+    async def remove_pattern(self, ctx, id_: int):
+        await self._remove_pattern_command(ctx, id_)
+
+    @pattern.command(name="list", ignore_extra=False)
+    async def list_patterns(self, ctx):
+        await self._list_patterns_command(ctx)
+
+    @pattern.command(name="enable", ignore_extra=False)
+    async def enable_pattern(self, ctx, id_: int):
+        await self._enable_pattern_command(ctx, id_)
+
+    @pattern.command(name="disable", ignore_extra=False)
+    async def disable_pattern(self, ctx, id_: int):
+        await self._disable_pattern_command(ctx, id_)
@@ -0,0 +1,43 @@
+import sys
+
+import mock
+
+
+# discord.py is replaced by mocks for the tests, except for the parts that decide what the
+# decorated commands and cogs end up as so those can still be invoked.
+
+
+def _passthrough(*args, **kwargs):
+    return lambda func: func
+
+
+class FakeCommand(object):
+    """Stands in for commands.Command and commands.Group, call callback to invoke the command."""
+
+    def __init__(self, func):
+        self.callback = func
+
+    def command(self, *args, **kwargs):
+        return FakeCommand
+
+    def group(self, *args, **kwargs):
+        return FakeCommand
+
+
+class FakeCog(object):
+
+    listener = staticmethod(_passthrough)
+
+
+discord = mock.MagicMock()
+commands = discord.ext.commands
+commands.Cog = FakeCog
+commands.command = lambda *args, **kwargs: FakeCommand
+commands.group = lambda *args, **kwargs: FakeCommand
+commands.has_permissions = _passthrough
+commands.is_owner = _passthrough
+commands.Bot.return_value.command = lambda *args, **kwargs: FakeCommand
+discord.HTTPException = type("HTTPException", (Exception,), {})
+
+sys.modules["discord"] = discord
+sys.modules["discord.ext"] = discord.ext
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import tracemalloc
+from collections import namedtuple
+
+import mock
+import pytest
+
+from ikabot import base
+from ikabot.base import MENU_PAGE_SIZE, _format_reaction_menu, _paginate
+
+
+FakeReaction = namedtuple("FakeReaction", ["emoji"])
+
+
+@pytest.mark.parametrize(
+    ("amount", "expected"),
+    [
+        (0, []),
+        (3, [[0, 1, 2]]),
+        (MENU_PAGE_SIZE, [list(range(MENU_PAGE_SIZE))]),
+        (40, [list(range(0, 16)), list(range(16, 32)), list(range(32, 40))]),
+    ]
+)
+def test_paginate(amount, expected):
+    """Test if reactions are split over pages that leave room for the menu controls."""
+    assert(_paginate(amount) == expected)
+
+
+def test_menu_page_size():
+    """Test if a page and the three menu controls fit in the 20 reactions discord allows per message."""
+    assert(MENU_PAGE_SIZE + 3 <= 20)
+
+
+def test_format_reaction_menu():
+    """Test if the menu letters restart per page and mark the selected reactions."""
+    emoji = mock.MagicMock()
+    emoji.name = "custom"
+    reactions = [FakeReaction("\N{THUMBS UP SIGN}"), FakeReaction(emoji), FakeReaction("x")]
+    pages = _paginate(len(reactions), page_size=2)
+
+    msg = _format_reaction_menu(reactions, pages, 0, {1})
+    assert("  a - \N{THUMBS UP SIGN}\n" in msg)
+    assert("* b - custom\n" in msg)
+    assert("page 1/2, 1 selected in total." in msg)
+
+    msg = _format_reaction_menu(reactions, pages, 1, {1})
+    assert("  a - x\n" in msg)
+    assert("custom" not in msg)
+
+    assert("page" not in _format_reaction_menu(reactions, [[0, 1, 2]], 0, set()))
+
+
+@pytest.fixture
+def ctx():
+    ctx = mock.MagicMock()
+    ctx.reply = mock.AsyncMock()
+    return ctx
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    base.set_log_dir(str(tmp_path))
+    yield tmp_path
+    base.set_log_dir(None)
+
+
+def test_dump_path(log_dir):
+    """Test if dumps end up in the configured log directory."""
+    path = base._dump_path("profile", "prof")
+    assert(os.path.dirname(path) == str(log_dir))
+    assert(os.path.basename(path).startswith("ikabot-profile-"))
+    assert(path.endswith(".prof"))
+
+
+def test_profile_commands(ctx, log_dir):
+    """Test if a profile writes its stats and summary to the log directory."""
+    asyncio.run(base.profile_start.callback(ctx))
+    asyncio.run(base.profile_stop.callback(ctx, 5))
+
+    assert(sorted(os.path.splitext(f)[1] for f in os.listdir(str(log_dir))) == [".prof", ".txt"])
+    assert("profile written to {0}".format(log_dir) in ctx.reply.await_args[0][0])
+
+
+def test_tracemalloc_commands(ctx, log_dir):
+    """Test if a tracemalloc snapshot and summary are written to the log directory."""
+    asyncio.run(base.tracemalloc_start.callback(ctx, 1))
+    asyncio.run(base.tracemalloc_stop.callback(ctx, 5))
+
+    assert(not tracemalloc.is_tracing())
+    assert(sorted(os.path.splitext(f)[1] for f in os.listdir(str(log_dir))) == [".snapshot", ".txt"])
+
+
+@pytest.mark.parametrize(
+    ("command", "argument"),
+    [
+        ("profile_stop", 0),
+        ("profile_stop", -1),
+        ("tracemalloc_start", 0),
+        ("tracemalloc_start", base.TRACEMALLOC_MAX_FRAMES + 1),
+        ("tracemalloc_stop", -1),
+        ("slow_callbacks", -1),
+    ]
+)
+def test_profiling_commands_invalid_arguments(ctx, log_dir, command, argument):
+    """Test if invalid amounts are refused before anything gets started or stopped."""
+    asyncio.run(getattr(base, command).callback(ctx, argument))
+
+    assert("must be" in ctx.reply.await_args[0][0])
+    assert(not tracemalloc.is_tracing())
+    assert(os.listdir(str(log_dir)) == [])
+
+
+def test_shutdown_drains_cogs(ctx):
+    """Test if shutdown drains every cog that can be drained before logging out."""
+    calls = list()
+
+    def create_drain(name):
+        async def drain(timeout):
+            calls.append((name, timeout))
+        return drain
+
+    draining = [mock.MagicMock(drain=create_drain(name)) for name in ("a", "b")]
+    plain = mock.MagicMock(spec=[])
+    ctx.bot.cogs = {"a": draining[0], "plain": plain, "b": draining[1]}
+    ctx.bot.logout = mock.AsyncMock(side_effect=lambda: calls.append("logout"))
+
+    asyncio.run(base.shutdown.callback(ctx))
+
+    assert(calls == [("a", base.SHUTDOWN_DRAIN_TIMEOUT), ("b", base.SHUTDOWN_DRAIN_TIMEOUT), "logout"])
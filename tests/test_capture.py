@@ -0,0 +1,78 @@
+import asyncio
+import os
+import re
+from collections import namedtuple
+
+from ikabot.capture import JoinRecorder, ReplayGuild, create_replay_banners, read_records, replay
+from ikabot.entrybanner import MemberMatcher
+
+
+FakeMember = namedtuple("FakeMember", ["id", "name", "discriminator", "avatar", "guild"])
+
+
+def test_join_recorder_roundtrip(tmp_path):
+    """Test if recorded joins are buffered and read back as written."""
+    path = str(tmp_path / "joins.jsonl")
+    recorder = JoinRecorder(path, flush_interval=60.0)
+    recorder.record(FakeMember(1, "raider", "0001", None, ReplayGuild(10)), 0, timestamp=100.0)
+    # The first join after a quiet period is written right away.
+    size = os.path.getsize(path)
+    assert(size > 0)
+    recorder.record(FakeMember(2, "user", "0002", "a1b2c3", ReplayGuild(10)), None, timestamp=101.0)
+    # Joins right after it are buffered.
+    assert(os.path.getsize(path) == size)
+    recorder.close()
+
+    records = list(read_records(path))
+    assert(records == [
+        {"t": 100.0, "g": 10, "u": 1, "n": "raider", "d": "0001", "a": None, "v": 0},
+        {"t": 101.0, "g": 10, "u": 2, "n": "user", "d": "0002", "a": "a1b2c3", "v": None},
+    ])
+
+
+def test_join_recorder_flush_interval(tmp_path):
+    """Test if buffered joins reach the file within the flush interval without closing the recorder."""
+    async def run():
+        path = str(tmp_path / "joins.jsonl")
+        recorder = JoinRecorder(path, flush_interval=0.01)
+        for i in range(3):
+            recorder.record(FakeMember(i, "user", "0001", None, ReplayGuild(10)), None, timestamp=100.0)
+
+        await asyncio.sleep(0.05)
+        assert([r["u"] for r in read_records(path)] == [0, 1, 2])
+        recorder.close()
+
+    asyncio.run(run())
+
+
+def test_join_recorder_rotation(tmp_path):
+    """Test if the capture gets rotated and only backup_count old captures are kept."""
+    path = str(tmp_path / "joins.jsonl")
+    recorder = JoinRecorder(path, max_bytes=1, backup_count=2)
+    for i in range(4):
+        recorder.record(FakeMember(i, "user", "0001", None, ReplayGuild(10)), None, timestamp=100.0)
+    recorder.close()
+
+    assert(sorted(os.listdir(str(tmp_path))) == ["joins.jsonl.1", "joins.jsonl.2"])
+    assert([r["u"] for r in read_records(path + ".1")] == [3])
+    assert([r["u"] for r in read_records(path + ".2")] == [2])
+
+
+def test_replay():
+    """Test if a replay reports the decisions and the joins that differ from the recording."""
+    matcher = MemberMatcher(re.compile("raid"), True, None)
+    banners = create_replay_banners([
+        {"guild_id": 10, "log_channel_id": None, "enabled": True, "patterns": [matcher.json()]},
+    ])
+    records = [
+        {"t": 100.0, "g": 10, "u": 1, "n": "raider", "d": "0001", "a": None, "v": 0},
+        {"t": 101.0, "g": 10, "u": 2, "n": "raid2", "d": "0002", "a": None, "v": None},
+        {"t": 102.0, "g": 10, "u": 3, "n": "user", "d": "0003", "a": None, "v": None},
+        {"t": 103.0, "g": 20, "u": 4, "n": "raider", "d": "0004", "a": None, "v": None},
+    ]
+
+    report = replay(records, banners)
+    assert(report["total"] == 3)
+    assert(report["skipped"] == 1)
+    assert(report["decisions"] == {(10, 0): 2, (10, None): 1})
+    assert(report["diffs"] == [(records[1], 0)])
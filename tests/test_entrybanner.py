@@ -1,14 +1,17 @@
-import sys
+import asyncio
 import re
+import time
 from collections import namedtuple
+from datetime import datetime
 
+import discord
 import mock
 import pytest
 
-sys.modules["discord"] = mock.MagicMock()
-sys.modules["discord.ext"] = mock.MagicMock()
-
-from ikabot.entrybanner import MemberMatcher
+from ikabot.entrybanner import (
+    AccountAgePredicate, DefaultAvatarPredicate, EntryBannerCog, EntryBannerCogError, GuildEntryBanner, JoinIndex,
+    MemberMatcher, NameCharsetPredicate, NameLengthPredicate, VerdictCache, parse_predicate, parse_since,
+)
 
 
 FakeMember = namedtuple("FakeMember", ["name"])
@@ -43,3 +46,365 @@ def test_member_matcher_call(is_enabled, string, expected):
     """Test if the matcher call works and it honors the enabled flag."""
     mm = MemberMatcher(re.compile("aaa"), is_enabled, None)
     assert(mm(FakeMember(string)) == expected)
+
+
+FakeAccount = namedtuple("FakeAccount", ["name", "id", "avatar"])
+
+# Snowflake of an account created at unix time 1600000000.
+ACCOUNT_ID = (1600000000 * 1000 - 1420070400000) << 22
+
+
+@pytest.mark.parametrize(
+    ("spec", "member", "now", "expected"),
+    [
+        ("avatar", FakeAccount("aaa", ACCOUNT_ID, None), None, True),
+        ("avatar", FakeAccount("aaa", ACCOUNT_ID, "a1b2c3"), None, False),
+        ("age:1d", FakeAccount("aaa", ACCOUNT_ID, None), 1600000000 + 60, True),
+        ("age:1d", FakeAccount("aaa", ACCOUNT_ID, None), 1600000000 + 2 * 86400, False),
+        ("length:3-5", FakeAccount("aaa", ACCOUNT_ID, None), None, True),
+        ("length:3-5", FakeAccount("aaaaaa", ACCOUNT_ID, None), None, False),
+        ("charset:lower", FakeAccount("aaa", ACCOUNT_ID, None), None, True),
+        ("charset:lower", FakeAccount("aA1", ACCOUNT_ID, None), None, False),
+    ]
+)
+def test_member_predicates(spec, member, now, expected):
+    """Test if the parsed predicates accept the right members."""
+    assert(parse_predicate(spec)(member, now) == expected)
+
+
+@pytest.mark.parametrize("spec", ["avatar:1", "age:xd", "length:5", "length:5-3", "charset:klingon", "colour"])
+def test_parse_predicate_invalid(spec):
+    """Test if invalid predicate specifications are refused."""
+    with pytest.raises(EntryBannerCogError):
+        parse_predicate(spec)
+
+
+def test_member_matcher_predicates_short_circuit():
+    """Test if a failing predicate skips the regex and passing ones fall through to it."""
+    pattern = mock.MagicMock()
+    pattern.match.return_value = True
+    mm = MemberMatcher(pattern, True, None, predicates=[
+        NameCharsetPredicate("lower"), DefaultAvatarPredicate(),
+    ])
+
+    assert(not mm(FakeAccount("aaa", ACCOUNT_ID, "a1b2c3")))
+    assert(not pattern.match.called)
+
+    assert(mm(FakeAccount("aaa", ACCOUNT_ID, None)))
+    pattern.match.assert_called_once_with("aaa")
+
+
+def test_guild_entry_banner_remove_predicate():
+    """Test if predicates can be removed again, keeping the pattern and its other predicates."""
+    update_cb = mock.MagicMock()
+    banner = GuildEntryBanner(mock.MagicMock(), None, True, update_cb)
+    banner.add_matcher(MemberMatcher(re.compile("a+"), True, {"banned_ids": [1]}))
+    banner.add_matcher_predicate(0, parse_predicate("age:1d"))
+    banner.add_matcher_predicate(0, parse_predicate("avatar"))
+
+    # Equal predicates match, regardless of how they were written down.
+    banner.remove_matcher_predicate(0, parse_predicate("age:86400s"))
+    assert(banner.json()["patterns"][0]["predicates"] == [{"type": "default_avatar"}])
+    assert(banner.json()["patterns"][0]["metadata"] == {"banned_ids": [1]})
+    assert(update_cb.call_count == 4)
+
+    with pytest.raises(EntryBannerCogError):
+        banner.remove_matcher_predicate(0, parse_predicate("age:1d"))
+
+
+def test_member_matcher_json_roundtrip():
+    """Test if the predicates survive storing and loading the matcher."""
+    mm = MemberMatcher(re.compile("a+"), True, None, predicates=[
+        AccountAgePredicate(3600), NameLengthPredicate(1, 4),
+    ])
+    loaded = MemberMatcher.create_from_json(mm.json())
+
+    assert(loaded.json() == mm.json())
+    assert(loaded(FakeAccount("aaa", ACCOUNT_ID, None), 1600000000 + 60))
+    assert(not loaded(FakeAccount("aaaaa", ACCOUNT_ID, None), 1600000000 + 60))
+
+    # Matchers stored before predicates existed still load.
+    legacy = mm.json()
+    del legacy["predicates"]
+    assert(MemberMatcher.create_from_json(legacy)(FakeAccount("aaaaa", ACCOUNT_ID, None)))
+
+
+FakeGuildMember = namedtuple("FakeGuildMember", ["name", "id", "avatar", "guild"])
+
+
+def test_verdict_cache_lru_and_ttl():
+    """Test if the cache evicts the least recently used verdict and honors the ttl."""
+    cache = VerdictCache(max_size=2, ttl=60.0)
+    cache.store("a", 0)
+    cache.store("b", None)
+    assert(cache.lookup("a") == (True, 0))
+
+    cache.store("c", 1)
+    assert(cache.lookup("b") == (False, None))
+    assert(cache.lookup("c") == (True, 1))
+    assert(cache.hits == 2 and cache.misses == 1)
+    assert(cache.hit_rate == pytest.approx(2 / 3))
+
+    with mock.patch("ikabot.entrybanner.time.monotonic", return_value=time.monotonic() + 120):
+        assert(cache.lookup("a") == (False, None))
+
+
+def test_guild_entry_banner_verdict_cache():
+    """Test if guilds with the same patterns share verdicts and pattern changes invalidate them."""
+    cache = VerdictCache()
+    guild_a, guild_b = mock.MagicMock(), mock.MagicMock()
+    banner_a = GuildEntryBanner(guild_a, None, True, lambda _: None, verdict_cache=cache)
+    banner_b = GuildEntryBanner(guild_b, None, True, lambda _: None, verdict_cache=cache)
+    for banner in (banner_a, banner_b):
+        banner.add_matcher(MemberMatcher(re.compile("raid"), True, None))
+
+    assert(banner_a.pattern_version == banner_b.pattern_version)
+    assert(banner_a.validate_member(FakeGuildMember("raider", 1, None, guild_a)) == 0)
+    assert(banner_b.validate_member(FakeGuildMember("raider", 2, None, guild_b)) == 0)
+    assert(cache.hits == 1)
+
+    version = banner_b.pattern_version
+    banner_b.disable_matcher(0)
+    assert(banner_b.pattern_version != version)
+    assert(banner_b.validate_member(FakeGuildMember("raider", 2, None, guild_b)) is None)
+    assert(banner_a.validate_member(FakeGuildMember("raider", 3, None, guild_a)) == 0)
+    assert(cache.hits == 2)
+
+    # The avatar predicate makes the avatar part of the key.
+    banner_a.add_matcher_predicate(0, DefaultAvatarPredicate())
+    assert(banner_a.validate_member(FakeGuildMember("raider", 1, "a1b2c3", guild_a)) is None)
+    assert(banner_a.validate_member(FakeGuildMember("raider", 1, None, guild_a)) == 0)
+
+
+def test_join_index():
+    """Test if the index keeps the members in join order through adds and removes."""
+    index = JoinIndex()
+    index.add(1, 100.0)
+    index.add(2, 300.0)
+    index.add(3, 200.0)
+    assert(index.since(0) == [1, 3, 2])
+    assert(index.since(200.0) == [3, 2])
+    assert(index.since(301.0) == [])
+
+    index.remove(3)
+    index.remove(4)
+    assert(index.since(0) == [1, 2])
+
+    # Rejoining moves the member to its new join time.
+    index.add(1, 400.0)
+    assert(index.since(0) == [2, 1])
+    assert(len(index) == 2)
+
+
+def test_join_index_from_members():
+    """Test if building the index in one go matches adding the members one by one."""
+    FakeJoinedMember = namedtuple("FakeJoinedMember", ["id", "joined_at"])
+    members = [
+        FakeJoinedMember(1, datetime(2021, 1, 1, 12, 10)),
+        FakeJoinedMember(2, datetime(2021, 1, 1, 12, 0)),
+        FakeJoinedMember(3, datetime(2021, 1, 1, 12, 5)),
+    ]
+    index = JoinIndex.from_members(members)
+    assert(index.since(0) == [2, 3, 1])
+    assert(len(index) == 3)
+
+    # The dict is seeded too, removes and rejoins keep working.
+    index.remove(3)
+    index.add(2, parse_since("2021-01-01T13:00:00"))
+    assert(index.since(0) == [1, 2])
+
+
+def test_members_joined_since():
+    """Test if members with roles are excluded and the index is seeded from the member cache."""
+    FakeJoinedMember = namedtuple("FakeJoinedMember", ["id", "joined_at", "roles"])
+    members = {
+        1: FakeJoinedMember(1, datetime(2021, 1, 1, 12, 0), ["@everyone"]),
+        2: FakeJoinedMember(2, datetime(2021, 1, 1, 12, 5), ["@everyone", "mod"]),
+        3: FakeJoinedMember(3, datetime(2021, 1, 1, 12, 10), ["@everyone"]),
+    }
+    guild = mock.MagicMock()
+    guild.members = list(members.values())
+    guild.get_member = members.get
+    banner = GuildEntryBanner(guild, None, True, lambda _: None)
+
+    since = parse_since("2021-01-01T12:05:00")
+    assert(banner.members_joined_since(since) == ([members[3]], 1))
+
+    banner.join_index.remove(3)
+    assert(banner.members_joined_since(since) == ([], 1))
+
+
+@pytest.mark.parametrize(
+    ("since_str", "expected"),
+    [
+        ("30m", 10000.0 - 30 * 60),
+        ("90", 10000.0 - 90),
+        ("1970-01-01T01:00:00", 3600.0),
+        ("1970-01-01T01:00:00+01:00", 0.0),
+    ]
+)
+def test_parse_since(since_str, expected):
+    """Test if both durations and timestamps are accepted."""
+    assert(parse_since(since_str, now=10000.0) == expected)
+
+
+def create_cog(**kwargs):
+    """Create an EntryBannerCog with a single enabled guild without patterns."""
+    guild = mock.MagicMock(id=1, members=[])
+    bot = mock.MagicMock()
+    bot.get_guild.return_value = guild
+    data_store = mock.MagicMock()
+    data_store.get.return_value = {
+        1: {"guild_id": 1, "log_channel_id": 2, "enabled": True, "patterns": []},
+    }
+    return EntryBannerCog(bot, data_store, **kwargs), guild
+
+
+def test_entry_banner_cog_drain_ignores_joins():
+    """Test if joins are not handled anymore once the cog is draining."""
+    async def run():
+        cog, guild = create_cog()
+        cog._handle_member_join = mock.AsyncMock()
+
+        await cog.drain(1.0)
+        await cog.on_member_join(mock.MagicMock(guild=guild, joined_at=None))
+        assert(not cog._handle_member_join.called)
+
+    asyncio.run(run())
+
+
+def test_entry_banner_cog_drain_waits():
+    """Test if drain waits for the join handlers that are still running."""
+    async def run():
+        cog, guild = create_cog()
+        release = asyncio.Event()
+        finished = list()
+
+        async def handle(guild_entry, member):
+            await release.wait()
+            finished.append(member)
+
+        cog._handle_member_join = handle
+        member = mock.MagicMock(guild=guild, joined_at=None)
+        join = asyncio.ensure_future(cog.on_member_join(member))
+        await asyncio.sleep(0)
+
+        drain = asyncio.ensure_future(cog.drain(1.0))
+        await asyncio.sleep(0.01)
+        assert(not drain.done())
+
+        release.set()
+        await drain
+        assert(finished == [member])
+        await join
+
+    asyncio.run(run())
+
+
+def test_entry_banner_cog_drain_timeout(caplog):
+    """Test if drain gives up after the timeout and logs the handlers left behind."""
+    async def run():
+        cog, guild = create_cog()
+        cog._handle_member_join = lambda guild_entry, member: asyncio.sleep(10)
+        join = asyncio.ensure_future(cog.on_member_join(mock.MagicMock(guild=guild, joined_at=None)))
+        await asyncio.sleep(0)
+
+        await asyncio.wait_for(cog.drain(0.01), 1.0)
+        assert(not join.done())
+        join.cancel()
+
+    asyncio.run(run())
+    assert("1 join handler(s) did not finish within 0.01s" in caplog.text)
+
+
+def test_entry_banner_cog_recorder_failure():
+    """Test if a failing join capture gets disabled and does not stop the ban."""
+    async def run():
+        recorder = mock.MagicMock()
+        recorder.record.side_effect = OSError("disk full")
+        cog, guild = create_cog(recorder=recorder)
+        guild_entry = cog._get_guild_config(guild)
+        guild_entry.add_matcher(MemberMatcher(re.compile("raid"), True, {"banned_ids": []}))
+        guild_entry.log_channel.send = mock.AsyncMock()
+
+        for i in range(2):
+            member = mock.MagicMock(guild=guild, joined_at=None, id=i)
+            member.name = "raider"
+            member.ban = mock.AsyncMock()
+            await cog.on_member_join(member)
+            member.ban.assert_awaited_once()
+
+        recorder.record.assert_called_once()
+        recorder.close.assert_called_once_with()
+
+    asyncio.run(run())
+
+
+def test_entry_banner_cog_builds_join_index():
+    """Test if the join index is built when the cog loads."""
+    with mock.patch.object(JoinIndex, "from_members") as from_members:
+        cog, guild = create_cog()
+    from_members.assert_called_once_with(guild.members)
+    assert(cog._lookup_guild_config(1).join_index is from_members.return_value)
+
+
+def test_entry_banner_cog_ban_since_failed_batch():
+    """Test if a failing batch is counted as failed and the other batches still get banned."""
+    async def run():
+        cog, guild = create_cog()
+        guild_entry = cog._get_guild_config(guild)
+        guild_entry.log_channel.send = mock.AsyncMock()
+        members = [mock.MagicMock(id=i, roles=["@everyone"]) for i in range(3)]
+        guild_entry.members_joined_since = mock.MagicMock(return_value=(members, 0))
+        guild.get_member = {m.id: m for m in members}.get
+
+        ctx = mock.MagicMock(guild=guild)
+        progress = mock.MagicMock(add_reaction=mock.AsyncMock(), edit=mock.AsyncMock())
+        ctx.reply = mock.AsyncMock(return_value=progress)
+        cog.bot.wait_for = mock.AsyncMock()
+        guild.bulk_ban = mock.AsyncMock(side_effect=[
+            discord.HTTPException(),
+            mock.MagicMock(banned=[members[1]], failed=[]),
+            mock.MagicMock(banned=[members[2]], failed=[]),
+        ])
+
+        with mock.patch("ikabot.entrybanner.BAN_BATCH_SIZE", 1), mock.patch("ikabot.entrybanner.BAN_BATCH_DELAY", 0):
+            await cog.ban_since.callback(cog, ctx, "30m")
+
+        assert(guild.bulk_ban.await_count == 3)
+        progress.edit.assert_awaited_with(content="banned 2/3 members, 1 failed.")
+        guild_entry.log_channel.send.assert_awaited_once()
+        assert("banned 2 members" in guild_entry.log_channel.send.call_args[0][0])
+
+    asyncio.run(run())
+
+
+def test_entry_banner_cog_ban_since_recheck():
+    """Test if members that changed while waiting for the confirmation, the bot and the owner are not banned."""
+    async def run():
+        cog, guild = create_cog()
+        guild_entry = cog._get_guild_config(guild)
+        guild_entry.log_channel.send = mock.AsyncMock()
+        members = [mock.MagicMock(id=i, roles=["@everyone"]) for i in range(5)]
+        guild_entry.members_joined_since = mock.MagicMock(return_value=(members, 0))
+        guild.me.id = 3
+        guild.owner_id = 4
+        current = {0: members[0]}
+
+        async def wait_for(*args, **kwargs):
+            # Member 1 gets a role and member 2 leaves before the ban gets confirmed.
+            current[1] = mock.MagicMock(id=1, roles=["@everyone", "verified"])
+
+        ctx = mock.MagicMock(guild=guild)
+        guild.get_member = current.get
+        ctx.reply = mock.AsyncMock(return_value=mock.MagicMock(add_reaction=mock.AsyncMock(), edit=mock.AsyncMock()))
+        cog.bot.wait_for = wait_for
+        guild.bulk_ban = mock.AsyncMock(return_value=mock.MagicMock(banned=[members[0]], failed=[]))
+
+        await cog.ban_since.callback(cog, ctx, "30m")
+
+        guild.bulk_ban.assert_awaited_once()
+        assert(guild.bulk_ban.call_args[0][0] == [members[0]])
+        assert("3 members without roles" in ctx.reply.call_args[0][0])
+
+    asyncio.run(run())
@@ -0,0 +1,14 @@
+import mock
+
+from ikabot import __main__ as main
+
+
+def test_tune_gc_once(monkeypatch):
+    """Test if the gc only gets tuned on the first invocation, on_ready fires on every reconnect."""
+    monkeypatch.setattr(main, "_gc_tuned", False)
+    with mock.patch.object(main, "gc") as gc:
+        main._tune_gc()
+        main._tune_gc()
+
+    gc.freeze.assert_called_once_with()
+    gc.set_threshold.assert_called_once_with(*main.GC_THRESHOLDS)
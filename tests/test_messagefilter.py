@@ -0,0 +1,201 @@
+import asyncio
+import re
+from collections import namedtuple
+
+import mock
+import pytest
+
+from ikabot.messagefilter import (
+    BULK_DELETE_LIMIT, DeleteBatcher, DuplicateTracker, GuildMessageFilter, MessageFilterCog, MessageMatcher,
+)
+
+
+FakeMessage = namedtuple("FakeMessage", ["id", "channel"])
+
+
+@pytest.mark.parametrize(
+    ("content", "expected"),
+    [
+        ("join discord.gg/abc now", True),
+        ("JOIN DISCORD.GG/ABC NOW", False),
+        ("discord.gg/ is great", False),
+        ("hello there", False),
+    ]
+)
+def test_message_matcher_call(content, expected):
+    """Test if the matcher needs both the keyword and the pattern."""
+    mm = MessageMatcher("Discord.gg", re.compile(r"discord\.gg/\w+"), True, None)
+    assert(mm(content, content.lower()) == expected)
+
+
+def test_message_matcher_keyword_prefilter():
+    """Test if the pattern is not tried when the keyword is missing."""
+    pattern = mock.MagicMock()
+    mm = MessageMatcher("discord.gg", pattern, True, None)
+
+    assert(not mm("hello there", "hello there"))
+    assert(not pattern.search.called)
+
+
+def test_guild_message_filter_validate_content():
+    """Test if the first matching pattern is returned and the enabled flags are honored."""
+    gf = GuildMessageFilter(mock.MagicMock(), None, True, lambda _: None, matchers=[
+        MessageMatcher("nitro", re.compile("free nitro"), False, None),
+        MessageMatcher("discord.gg", re.compile(r"discord\.gg/\w+"), True, None),
+    ])
+    assert(gf.validate_content("Free nitro at discord.gg/abc") == 1)
+    assert(gf.validate_content("free nitro") is None)
+
+    gf.enable_matcher(0)
+    assert(gf.validate_content("free nitro") == 0)
+
+    gf.disable()
+    assert(gf.validate_content("free nitro") is None)
+
+
+def test_duplicate_tracker():
+    """Test if repeated content within the window is flagged once over the limit."""
+    tracker = DuplicateTracker()
+    key = (1, 2)
+    assert([tracker.check(key, "spam", 2, 10.0, now=t) for t in range(4)] == [False, False, True, True])
+
+    # Different content or an expired window starts counting again.
+    assert(not tracker.check(key, "other", 2, 10.0, now=4))
+    assert(not tracker.check(key, "other", 2, 10.0, now=5))
+    assert(not tracker.check(key, "other", 2, 10.0, now=20))
+
+
+@pytest.mark.parametrize("content", ["", "  ", "\n"])
+def test_duplicate_tracker_empty_content(content):
+    """Test if messages without text, like attachment only ones, are never flagged."""
+    tracker = DuplicateTracker()
+    assert(not any(tracker.check((1, 2), content, 1, 10.0, now=t) for t in range(5)))
+    assert(len(tracker) == 0)
+
+
+def test_duplicate_tracker_bounded():
+    """Test if the tracker forgets the least recently active authors."""
+    tracker = DuplicateTracker(max_authors=2)
+    for author in range(3):
+        tracker.check((1, author), "spam", 1, 10.0, now=0)
+    assert(len(tracker) == 2)
+
+    # Author 0 was forgotten so this counts as a first message.
+    assert(not tracker.check((1, 0), "spam", 1, 10.0, now=1))
+    assert(tracker.check((1, 2), "spam", 1, 10.0, now=1))
+
+
+def test_delete_batcher():
+    """Test if queued messages are deleted per channel in bulk."""
+    async def run():
+        channel_a, channel_b = mock.MagicMock(id=1), mock.MagicMock(id=2)
+        channel_a.delete_messages = mock.AsyncMock()
+        single = mock.MagicMock(id=10, channel=channel_b)
+        single.delete = mock.AsyncMock()
+        flushed = mock.AsyncMock()
+
+        batcher = DeleteBatcher(delay=0.01, flush_callback=flushed)
+        batch = [FakeMessage(i, channel_a) for i in range(3)]
+        for message in batch + [single]:
+            batcher.add(message)
+        await asyncio.sleep(0.05)
+
+        channel_a.delete_messages.assert_awaited_once_with(batch)
+        single.delete.assert_awaited_once_with()
+        assert(flushed.await_count == 2)
+
+    asyncio.run(run())
+
+
+def test_delete_batcher_failing_callback():
+    """Test if a failing flush callback does not stop the remaining chunks from being deleted."""
+    async def run():
+        channel = mock.MagicMock(id=1)
+        channel.delete_messages = mock.AsyncMock()
+        flushed = mock.AsyncMock(side_effect=RuntimeError("log channel is gone"))
+
+        batcher = DeleteBatcher(delay=0.01, flush_callback=flushed)
+        for i in range(BULK_DELETE_LIMIT + 50):
+            batcher.add(FakeMessage(i, channel))
+        await asyncio.wait_for(batcher.drain(), 1.0)
+
+        assert(channel.delete_messages.await_count == 2)
+        assert(flushed.await_count == 2)
+
+    asyncio.run(run())
+
+
+def test_delete_batcher_drain_during_flush():
+    """Test if drain waits for a flush that is already deleting messages."""
+    async def run():
+        release = asyncio.Event()
+        deleted = list()
+
+        async def delete_messages(messages):
+            await release.wait()
+            deleted.extend(messages)
+
+        channel = mock.MagicMock(id=1)
+        channel.delete_messages = delete_messages
+        batcher = DeleteBatcher(delay=0.01)
+        batch = [FakeMessage(i, channel) for i in range(2)]
+        for message in batch:
+            batcher.add(message)
+        await asyncio.sleep(0.05)
+
+        drain = asyncio.ensure_future(batcher.drain())
+        await asyncio.sleep(0.01)
+        assert(not drain.done())
+
+        release.set()
+        await asyncio.wait_for(drain, 1.0)
+        assert(deleted == batch)
+
+    asyncio.run(run())
+
+
+def test_delete_batcher_drain_before_delay():
+    """Test if drain deletes the queued messages without waiting for the delay."""
+    async def run():
+        channel = mock.MagicMock(id=1)
+        channel.delete_messages = mock.AsyncMock()
+        batcher = DeleteBatcher(delay=10.0)
+        batch = [FakeMessage(i, channel) for i in range(2)]
+        for message in batch:
+            batcher.add(message)
+
+        await asyncio.wait_for(batcher.drain(), 1.0)
+        channel.delete_messages.assert_awaited_once_with(batch)
+
+    asyncio.run(run())
+
+
+def test_cog_skips_missing_guilds():
+    """Test if configurations of guilds the bot cannot find are skipped when loading."""
+    bot = mock.MagicMock()
+    bot.get_guild.side_effect = lambda id_: None if id_ == 2 else mock.MagicMock(id=id_)
+    data_store = mock.MagicMock()
+    data_store.get.return_value = {
+        str(id_): {
+            "guild_id": id_, "log_channel_id": 3, "enabled": True, "patterns": [],
+            "duplicate_limit": 0, "duplicate_window": 30.0,
+        } for id_ in (1, 2)
+    }
+
+    cog = MessageFilterCog(bot, data_store)
+
+    assert(cog._lookup_guild_config(1).guild.id == 1)
+    assert(cog._lookup_guild_config(2) is None)
+
+
+def test_cog_drain_ignores_messages():
+    """Test if messages are not handled anymore once the cog is draining."""
+    async def run():
+        cog = MessageFilterCog(mock.MagicMock(), mock.MagicMock())
+        cog._lookup_guild_config = mock.MagicMock()
+
+        await cog.drain(1.0)
+        await cog.on_message(mock.MagicMock())
+        assert(not cog._lookup_guild_config.called)
+
+    asyncio.run(run())